@@ -1,14 +1,23 @@
 import tkinter as tk
-from tkinter import messagebox
-import serial.tools.list_ports
-import csv
+from tkinter import messagebox, filedialog
 import os
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import random
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import time
 
+import serialCodec
 import serialCom
+import asyncSerialCom
+import deviceDiscovery
+import deviceRegistry
+import perfStats
+import programmingQueue
+import settingsHistory
+import settingsLog
+import taskScheduler
+import userStore
+from egramPlot import DualEgramPlotter
+from egramRecord import RECORD_FOLDER
+from egramViewer import EgramViewer
 from globalVars import defaultParams
 
 # Setting default parameters for pacemaker
@@ -22,16 +31,17 @@ btn_login = None
 btn_register = None
 lbl_device = None
 
-# Finds current port
-ports = list(serial.tools.list_ports.comports())
-currPort = None
-# To find port pacemaker is connected to:
-for port in ports:
-    print(port.description)
+# Watches for the pacemaker being plugged in or out, everything else reads
+# its cached state instead of enumerating the ports
+device_monitor = deviceDiscovery.DeviceMonitor()
+device_monitor.start()
 
-    if "JLink" in port.description: 
-        currPort = port.device
-        break
+# Every pacemaker seen so far, with when it was seen and last programmed
+DEVICE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'devices.csv')
+device_registry = deviceRegistry.DeviceRegistry(DEVICE_FILE)
+
+# Port the pacemaker is connected to, follows it when it is plugged back in
+currPort = device_monitor.state.port
 
 if currPort:
     print(f"Device is connected to: {currPort}")
@@ -43,92 +53,22 @@ else:
 # and sample functions to simulate graphs based on random data
 '''
  
-# Collections of egram data will be conside#AA0000 objects
-class EgramData:
- 
-    # Construct object
-    def __init__(self):
-        # Manage labelling x axis
-        self.counter = 0
-        self.timestamps = []
- 
-        # Labelling y axis
-        self.voltages = []    
- 
-    # Setter. Take a datapoint and append to lists of past data
-    def add_data(self, voltage):
- 
-        # Add timestamp and voltage to the lists
-        self.timestamps.append(self.counter)
-        self.voltages.append(voltage)
-        self.counter+=1
-       
-        # Keep only the last 20 points
-        if len(self.timestamps) > 20:
-            self.timestamps = self.timestamps[-20:]
-            self.voltages = self.voltages[-20:]
- 
-    # Getter for data
-    def get_data(self):
-        return self.timestamps, self.voltages
-
-# Parent class of plots, each plot will have derived class in future assingments
-class EgramPlotter:
-    def __init__(self, title):
-        # Initialize plot
-        self.fig, self.ax = plt.subplots()
-        self.title = title
-        self.data = EgramData()
- 
-        # new code:
-        self.ser = None  
-        self.window = tk.Tk()
-        self.window.title(self.title)
- 
-        # Embed the Matplotlib figure in the Tkinter window
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.window)
-        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
- 
-        # Add the exit button
-        self.exit_button = tk.Button(self.window, text="Exit", command=self.close_window)
-        self.exit_button.pack(side=tk.BOTTOM)
-    
-    # Closes egram plot window
-    def close_window(self):
-        """Close the graph window and properly close the serial connection."""
-        if self.ser and self.ser.is_open:
-            self.ser.close()
-            print("Serial connection closed.")
-        self.window.destroy()
- 
-    # This generates each frame of animation
-    def animate(self, i):
-        # Generate random voltage data
-        # val = random.randrange(-10, 10, 1)
-        # voltage = round(val, 2)
-        with serial.Serial(currPort, baudrate=115200,timeout=1) as ser:
-            voltage = serialCom.get_plotData(ser,params)
- 
-        # Add that data
-        self.data.add_data(voltage)
- 
-        # Collect data for plotting every frame
-        timestamps, voltages = self.data.get_data()
- 
-        # Draw the plot every time
-        self.ax.clear()
-        self.ax.plot(timestamps, voltages)
- 
-        # Format plot
-        self.ax.set_title(self.title)
-        self.ax.set_ylabel('Voltage(V)')
-        plt.xticks(rotation=45)
- 
- 
-    def start_animation(self, interval):
-        anim = animation.FuncAnimation(self.fig, self.animate, interval=interval)
-        self.window.mainloop()
-    
+# Egram samples requested from the pacemaker per second, and time between
+# redraws of the plot in ms. The two are independent of each other
+EGRAM_SAMPLE_RATE = 100
+EGRAM_FRAME_INTERVAL = 33
+
+# Time between checks of the cached device state in ms
+DEVICE_LABEL_INTERVAL = 200
+
+# Time between writes of the device registry's queued changes in ms
+REGISTRY_FLUSH_INTERVAL = 2000
+
+# How long a settings screen's status message stays up in ms
+STATUS_CLEAR_DELAY = 3000
+
+# Number of samples kept and shown by each plot
+EGRAM_HISTORY = 5 * EGRAM_SAMPLE_RATE
 
 def normalize(data, min_val=None, max_val=None):
         min_val = min_val if min_val is not None else min(data)
@@ -136,161 +76,107 @@ def normalize(data, min_val=None, max_val=None):
         return [(v - min_val) / (max_val - min_val) for v in data] if max_val != min_val else [0.5 for _ in data]
 
  
-# Shell derived class for atrium plot, will be used in future assingments
-class AtriumPlotter(EgramPlotter):
-    def __init__(self):
-        # Initialize from the parent class
-        super().__init__("Atrium Electrogram")
+# Egram window currently open, there is only ever one reading the port
+egram_plotter = None
 
-    def animate(self, i):
-        with serial.Serial(currPort, baudrate=115200, timeout=1) as ser:
-            voltages = serialCom.get_plotData(ser, params)
-
-        if voltages is not None:
-            voltage = voltages[0]  # Use unpacked[0] for atrium
-            self.data.add_data(voltage)
-
-
-        # Collect data for plotting every frame
-        timestamps, voltages = self.data.get_data()
-
-        # Draw the plot
-        self.ax.clear()
-        self.ax.plot(timestamps, voltages)
+# Plot both chambers in one window
+def plot_egram():
+    global egram_plotter
+    if egram_plotter is not None and not egram_plotter.closed:
+        egram_plotter.window.lift()
+        return
 
-        # Format plot
-        self.ax.set_title(self.title)
-        self.ax.set_ylabel('Voltage(V)')
-        self.ax.set_ylim(0, 1)  # Set static y-axis range
-        plt.xticks(rotation=45)
- 
- 
-# Shell derived class for ventricle plot, will be used in future assingments
-class VentriclePlotter(EgramPlotter):
-    def __init__(self):
-        # Initialize from the parent class
-        super().__init__("Ventricle Electrogram")
+    egram_plotter = DualEgramPlotter(currPort, params, EGRAM_SAMPLE_RATE, EGRAM_HISTORY, find_device())
+    egram_plotter.start_animation(EGRAM_FRAME_INTERVAL, scheduler.timer("egram_refresh", EGRAM_FRAME_INTERVAL))
 
-    def animate(self, i):
-        with serial.Serial(currPort, baudrate=115200, timeout=1) as ser:
-            voltages = serialCom.get_plotData(ser, params)
-        
-        if voltages is not None:
-            voltage = voltages[1]  # Use unpacked[1] for ventricle
-            self.data.add_data(voltage)
-        
-        # Collect data for plotting every frame
-        timestamps, voltages = self.data.get_data()
+# Pick a saved egram recording and open it in the replay viewer
+def view_recording():
+    path = filedialog.askopenfilename(title="Open Egram Recording", initialdir=RECORD_FOLDER,
+                                      filetypes=[("Egram recordings", "*.egram")])
+    if not path:
+        return
+    try:
+        viewer = EgramViewer(path)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Error", f"Could not open recording: {str(e)}")
+        return
+    viewer.run()
 
-        # Draw the plot
-        self.ax.clear()
-        self.ax.plot(timestamps, voltages)
+# Diagnostics window currently open
+diagnostics = None
 
-        # Format plot
-        self.ax.set_title(self.title)
-        self.ax.set_ylabel('Voltage(V)')
-        plt.xticks(rotation=45)
- 
- 
-# Plot each graph
-def plot_vent():
-    ventricle_plotter = VentriclePlotter()
-    ventricle_plotter.start_animation(100)
- 
- 
-def plot_atrium():
-    atrium_plotter = AtriumPlotter()
-    atrium_plotter.start_animation(100)
+# Live timings and counters of the serial link and egram plot
+def show_diagnostics():
+    global diagnostics
+    if diagnostics is not None and not diagnostics.closed:
+        diagnostics.lift()
+        return
+    diagnostics = perfStats.DiagnosticsWindow(root, scheduler)
  
 '''
 # This section contains functions that handle the logic for initializing and storing users
 '''
 
-def make_csvs():
+# Path of a user's settings history. Users get their storage the first time
+# they save settings, nothing is created or rewritten at login
+def get_user_csv_path(username, create=False):
     FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
-    USER_FILE = os.path.join(FOLDER_PATH, 'users.csv')
+    SUBFOLDER = os.path.join(FOLDER_PATH, 'user_csvs')
 
-    # Step 1: Create a new folder inside the directory to store CSV files
-    output_folder = os.path.join(FOLDER_PATH, 'user_csvs')
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-        print(f"Folder '{output_folder}' created.")
-    else:
-        print(f"Folder '{output_folder}' already exists.")
-
-    # Step 2: Read each row of login info and create individual CSV files
-    if os.path.exists(USER_FILE):
-        with open(USER_FILE, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                if len(row) == 2:  # Assuming each row contains [username, password]
-                    username, password = row
-                    user_file_path = os.path.join(output_folder, f"{username}.csv")
-
-                    # Step 3: Create a CSV file for each username
-                    with open(user_file_path, mode='w', newline='') as user_file:
-                        writer = csv.writer(user_file)
-                        # Write a header or any desired content for each user
-                        writer.writerow(["ID", "Data"])
-                        print(f"CSV file created for user: {username}")
-
-
-# Load in users to check logins
+    if create and not os.path.exists(SUBFOLDER):
+        os.makedirs(SUBFOLDER, exist_ok=True)
+        print(f"Folder '{SUBFOLDER}' created.")
+    return os.path.join(SUBFOLDER, f"{username}.csv")
+
+
+# A user's settings history, opened once per session. A history saved by an
+# older DCM as <name>.csv is moved into the log the first time it is opened
+def get_user_settings_log(username, create=False):
+    log = settings_logs.get(username)
+    if log is not None:
+        return log
+
+    csv_path = get_user_csv_path(username, create)
+    log = settingsLog.SettingsLog(os.path.splitext(csv_path)[0] + '.jsonl')
+    if not len(log) and os.path.exists(csv_path):
+        imported = log.import_csv(csv_path)
+        os.replace(csv_path, csv_path + '.migrated')
+        print(f"Moved {imported} saved settings from {username}.csv to {username}.jsonl")
+    settings_history.sync(username, log)
+    settings_logs[username] = log
+    return log
+
+
+# Open the user store, moving users over from users.csv the first time
 def load_users():
-    # Find path to CSV containing login info
+    global user_store
     FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
     USER_FILE = os.path.join(FOLDER_PATH, 'users.csv')
- 
-    # Read each row of login info
-    if os.path.exists(USER_FILE):
-        with open(USER_FILE, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                if len(row) == 2:  
- 
-                    # Add entry to dictionary
-                    name, password = row
-                    users_db[name] = password
+    USER_DB = os.path.join(FOLDER_PATH, 'users.db')
 
+    user_store = userStore.UserStore(USER_DB)
+    migrated = user_store.migrate_csv(USER_FILE)
+    if migrated:
+        print(f"Moved {migrated} users from users.csv to users.db")
 
-# Locally save valid login info
+
+# Locally save valid login info, returns False if the name is taken
 def save_user(name, password):
- 
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))  
-    USER_FILE = os.path.join(FOLDER_PATH, 'users.csv')
- 
-    # Write all current logins to CSV
-    with open(USER_FILE, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        for name, password in users_db.items():
-            writer.writerow([name, password])
+    return user_store.add(name, password)
  
  
 # Validation of user registration
 def register_user():
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
-    USER_FILE = os.path.join(FOLDER_PATH, 'users.csv')
- 
-    # Count the locally sto#AA0000 users
-    userNum = 0
-    if os.path.exists(USER_FILE):
-        for row in open(USER_FILE):  
-            userNum += 1
- 
     # Pull user input
     name = entry_name.get()
     password = entry_password.get()
  
     # Check that both fields are filled
     if name and password:
-        if userNum >= 10:
-            messagebox.showerror("Error", "Too many users!")
-        elif name in users_db:  
-            messagebox.showerror("Error", "User already exists!")
-        else:
-            users_db[name] = password
-            save_user(name, password)  
+        if save_user(name, password):
             messagebox.showinfo("Registration", "User registe#AA0000 successfully!")
+        else:
+            messagebox.showerror("Error", "User already exists!")
     else:
         messagebox.showerror("Error", "Please fill out both fields.")
  
@@ -301,11 +187,10 @@ def login_user():
     password = entry_password.get()
 
     # Validate login info
-    if name in users_db and users_db[name] == password:
+    if user_store.check(name, password):
         messagebox.showinfo("Login", f"Welcome, {name}!")
         global curr_user
         curr_user = name
-        make_csvs()
         mode_picker()
     else:
         messagebox.showerror("Error", "Incorrect username or password.")
@@ -314,32 +199,13 @@ def login_user():
 # This section contains the pacemaker discovery logic
 '''
  
-# Retrieve the unique device serial number
-def get_serial(hwid):
-    sections = hwid.split()
-    for section in sections:
-        if section.startswith("SER="):
-            serial_number = section.split('=')[1]  # Get the value after "SER="
-            return serial_number
- 
-# Check if there is a device connected and if so, return its info
+# Serial number of the connected pacemaker, None if there isn't one
 def find_device():
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))  
-    USER_FILE = os.path.join(FOLDER_PATH, 'devices.csv')
+    return device_monitor.state.serial
  
-    # Create tuple of ports and their connected info
-    ports = list(serial.tools.list_ports.comports())
-
-    for port in ports:
-        # Check if pacemaker is connected
-         if "JLink" in port.description:
-            return get_serial(port.hwid)  # Use hwid for hardware ID containing the serial number
-    return None  
- 
-# Determine whether the device is new
+# Determine whether the device is new. Checks the in-memory registry, the
+# device is written to devices.csv with the registry's next flush
 def save_device():
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
-    DEVICE_FILE = os.path.join(FOLDER_PATH, 'devices.csv')
     connected_device = find_device()
    
     if connected_device is None:
@@ -347,24 +213,15 @@ def save_device():
         return 0
  
     # Check if device is new
-    if not os.path.exists(DEVICE_FILE):
-        with open(DEVICE_FILE, mode='w', newline='') as file:  # Create the file if it doesn't exist
-            pass  # Just create an empty file
- 
-    with open(DEVICE_FILE, mode='r', newline='') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if connected_device in row:
-                print("Device already saved.")
-                return 1
- 
-    # If not, write the device info to the CSV
-    with open(DEVICE_FILE, mode='a', newline='') as file:  
-        writer = csv.writer(file)
-        writer.writerow([connected_device])
-        print("Device saved.")
-        messagebox.showinfo("Device", f"This device hasn't been connected yet!")
-        return 2
+    if connected_device in device_registry:
+        print("Device already saved.")
+        return 1
+ 
+    # If not, add it to the registry
+    device_registry.add(connected_device)
+    print("Device saved.")
+    messagebox.showinfo("Device", f"This device hasn't been connected yet!")
+    return 2
  
 '''
 # This section contains the mode picker screen, and connected device logic
@@ -391,91 +248,80 @@ def alert_user():
     messagebox.showinfo("Warning: A different pacemaker is approached than was previously interrogated")
  
  
-# Thread that updates connected device in background
+# Version of the device state last handled by update_device_label
+device_version = None
+
+# Shows the connected device and reacts when it changes. Only reads the
+# monitor's cached state, the ports are never enumerated here. Runs as the
+# scheduler's "device_label" job while the mode picker has been shown
 def update_device_label():
     # Global var for first device, will be referenced for program runtime
-    global first_device
-    save_check = save_device()
-    current_device = find_device()
-   
-    # Check if the device is not connected, new, or previously saved
-    if save_check == 0:
-        lbl_device.config(text="No device connected.")
-    elif save_check == 1:
-        lbl_device.config(text=f"Now communicating with device: \n{find_device()}")
-       
-        # if the first device hasn't been defined
-        if first_device_flag == False:
-            # Define first device
-            first_device = get_first_device()
- 
-        # We only want the user to be alerted of different device once, so check
-        # that there is a first device already, the current device is different,
-        # and the user hasn't already been notified
-        if (first_device_flag == True) and (current_device != first_device) and (device_compare_flag == False):
-            alert_user()
- 
-        # When the first device is connected, get ready to flag different device
-        if (first_device_flag == True) and (current_device == first_device):
-            device_compare_flag = False
-       
+    global first_device, device_compare_flag, device_version, currPort
+    # Version before state, a change in between is picked up next time
+    version = device_monitor.version
+    state = device_monitor.state
+
+    if state.connected:
+        lbl_device.config(text=f"Now communicating with device: \n{state.serial}")
     else:
-        lbl_device.config(text=f"Now communicating with device: \n{find_device()}")
- 
-        if first_device_flag == False:
-            first_device = get_first_device()
-       
-        if (first_device_flag == True) and (current_device != first_device) and (device_compare_flag == False):
-            alert_user()
- 
-        if (first_device_flag == True) and (current_device == first_device):
-            device_compare_flag = False
-       
-    # Schedule the function to run recursively every 1000 ms
-    root.after(1000, update_device_label)
+        lbl_device.config(text="No device connected.")
+
+    # Record and compare the device only when something was plugged in or out
+    if version != device_version:
+        device_version = version
+        if state.port:
+            currPort = state.port
+
+        new_device = save_device()
+        device_registry.observe(state.serial)
+        if new_device != 0:
+            # if the first device hasn't been defined
+            if first_device_flag == False:
+                # Define first device
+                first_device = get_first_device()
+
+            # We only want the user to be alerted of different device once, so check
+            # that there is a first device already, the current device is different,
+            # and the user hasn't already been notified
+            if (first_device_flag == True) and (state.serial != first_device) and (device_compare_flag == False):
+                alert_user()
+
+            # When the first device is connected, get ready to flag different device
+            if (first_device_flag == True) and (state.serial == first_device):
+                device_compare_flag = False
 
 def clear_window():
     for widget in root.winfo_children():
-        if widget != lbl_device:  # Skip lbl_device
-            widget.destroy()  # Destroy other widgets
-        else:
+        if widget == lbl_device:
             widget.grid_forget()  # Hide lbl_device, but don't destroy it
+        elif diagnostics is not None and widget == diagnostics.window:
+            continue  # Keep the diagnostics window open across screens
+        else:
+            widget.destroy()  # Destroy other widgets
 
 def logout_user():
+    scheduler.cancel("device_label")
     clear_window()  # Clear the current screen
     show_login_screen()  # Show the login screen again
 
 def display_current_settings():
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))  
-    SUBFOLDER = os.path.join(FOLDER_PATH, 'user_csvs')
- 
-    def get_user_csv_path(username):
-        return os.path.join(SUBFOLDER, f"{username}.csv")
- 
-    # Get the path to the current user's CSV file
-    PARAMETER_FILE = get_user_csv_path(curr_user)
- 
-    # Check if the CSV file exists
-    if not os.path.exists(PARAMETER_FILE):
-        messagebox.showerror("Error", "No saved settings found for the current user!")
-        return
- 
+    # Only the last entry is read, however long the history is
     try:
-        # Read the last row from the CSV file
-        with open(PARAMETER_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            rows = list(reader)  # Read all rows into a list
-            if not rows:  # Check if the file is empty
-                messagebox.showerror("Error", "No settings found in the file!")
-                return
-            last_row = rows[-1]  # Get the most recent settings
- 
-        # Display the settings in a popup
-        settings_display = "\n".join([f"{key}: {value}" for key, value in enumerate(last_row)])
-        messagebox.showinfo("Current Settings", f"Most Recent Settings:\n\n{settings_display}")
- 
+        latest = get_user_settings_log(curr_user).latest()
     except Exception as e:
-        messagebox.showerror("Error", f"Could not read settings: {str(e)}")        
+        messagebox.showerror("Error", f"Could not read settings: {str(e)}")
+        return
+
+    if latest is None:
+        messagebox.showerror("Error", "No saved settings found for the current user!")
+        return
+
+    # Display the settings in a popup
+    saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(latest["time"])) if latest["time"] else "unknown"
+    lines = [f"Mode: {latest['mode']}", f"Saved: {saved}", f"Device: {latest['device'] or 'unknown'}", ""]
+    lines += [f"{key}: {value}" for key, value in latest["params"].items()]
+    messagebox.showinfo("Current Settings", "Most Recent Settings:\n\n" + "\n".join(lines))
+
 # Call this to create the mode selector window
 def mode_picker():
     clear_window()
@@ -538,12 +384,9 @@ def mode_picker():
     btn_aair = tk.Button(root, text="AAIR", command=open_aair_pacing_settings, width=12, height=2)
     btn_aair.grid(row=5, column=2, padx=10, pady=10)
 
-    # Egram buttons placed in a single row at the bottom
-    btn_vent_egram = tk.Button(root, text="Ventricle Egram", command=plot_vent, width=12, height=2)
-    btn_vent_egram.grid(row=6, column=1, padx=10, pady=10)
-
-    btn_atrial_egram = tk.Button(root, text="Atrium Egram", command=plot_atrium, width=12, height=2)
-    btn_atrial_egram.grid(row=6, column=2, padx=10, pady=10)
+    # Egram button placed in a single row at the bottom
+    btn_egram = tk.Button(root, text="Atrium + Ventricle Egram", command=plot_egram, width=28, height=2)
+    btn_egram.grid(row=6, column=1, columnspan=2, padx=10, pady=10)
 
     # Logout button
     btn_logout = tk.Button(root, text="Logout", command=logout_user, bg="#AA0000", fg="white", width=10, height=2)
@@ -552,13 +395,23 @@ def mode_picker():
     # User indication
     lbl_username = tk.Label(root, text=f"----  {curr_user} is logged in  ----", font=("Helvetica", 10, "bold"), fg="green")
     lbl_username.grid(row=8, column=0, columnspan=4, pady=(0, 20))
+
+    # Replay of saved egram recordings
+    btn_recordings = tk.Button(root, text="Egram Recordings", command=view_recording, width=15, height=1)
+    btn_recordings.grid(row=9, column=0, columnspan=4, pady=(0, 20))
+
+    # Serial and egram performance statistics
+    btn_diagnostics = tk.Button(root, text="Diagnostics", command=show_diagnostics, width=15, height=1)
+    btn_diagnostics.grid(row=10, column=0, columnspan=4, pady=(0, 20))
  
     # Current settings button
     btn_settings = tk.Button(root, text="Current Settings", command=display_current_settings, bg="#E49B0F", fg="white", width=15, height=2)
     btn_settings.grid(row=7, column=1, columnspan=4, padx=(0,230), pady=(20, 20))  # Cente#AA0000 below the mode selection buttons
 
-    # Run this function recursively, update the connected device at interval
+    # Keep the device label current. Scheduling the job again replaces the
+    # running one, so coming back to this screen never adds another loop
     update_device_label()
+    scheduler.every("device_label", DEVICE_LABEL_INTERVAL, update_device_label)
 
 '''
 # This section handles the logic of storing the parameters to a CSV
@@ -573,35 +426,96 @@ def mode_picker():
 #         writer.writerow(['Time', 'VOO', 'AOO', 'VVI', 'AAI', 'Values'])        
  
 
-def save_settings(mode, params):
-    FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))  
-    SUBFOLDER = os.path.join(FOLDER_PATH, 'user_csvs')
+# Queue parameters for the pacemaker once the clinician has seen what will
+# change. They are sent on the background event loop so the screen doesn't
+# freeze, and the screen's status label follows them from waiting to
+# confirmed. Submitting again before they are sent replaces them. Returns
+# False if nothing was queued
+def program_device(params, lbl_status):
+    serial_number = find_device()
+    image = device_image(serial_number)
 
-    def get_user_csv_path(username):
-        return os.path.join(SUBFOLDER, f"{username}.csv")
-    
-    PARAMETER_FILE = get_user_csv_path(curr_user)
- 
-    # Open the CSV file in append mode
-    with open(PARAMETER_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        # Check for mode and write appropriate data to CSV
-        if mode == 'VOO':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["vent_amp"], params["vent_pw"]])
-        elif mode == 'AOO':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["atr_amp"], params["atr_pw"]])
-        elif mode == 'VVI':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["vent_amp"], params["vent_pw"], params["vent_sens"], params["vrp"]])
-        elif mode == 'AAI':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["atr_amp"], params["atr_pw"], params["atr_sens"], params["arp"], params["pvarp"]])
-        elif mode == 'VOOR':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["vent_amp"], params["vent_pw"], params["msr"], params["act_thresh"], params["reaction_time"], params["response_fact"], params["recovery_time"]])  
-        elif mode == 'AOOR':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["atr_amp"], params["atr_pw"], params["msr"], params["act_thresh"], params["reaction_time"], params["response_fact"], params["recovery_time"]])  
-        elif mode == 'VVIR':
-            writer.writerow([0,params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["vent_amp"], params["vent_pw"], params["vent_sens"], params["vrp"], params["msr"], params["act_thresh"], params["reaction_time"], params["response_fact"], params["recovery_time"]])  
-        elif mode == 'AAIR':
-            writer.writerow([0, params["mode"], params["rate_adapt"], params["lrl"], params["url"], params["atr_amp"], params["atr_pw"], params["atr_sens"], params["arp"], params["pvarp"], params["msr"], params["act_thresh"], params["reaction_time"], params["response_fact"], params["recovery_time"]])  
+    if image is None:
+        changes = None
+        summary = ("This pacemaker's current settings aren't known, every parameter will be sent:\n\n"
+                   + "\n".join(f"{field}: {params[field]}" for field in serialCodec.param_fields))
+    else:
+        changes = serialCodec.changed_params(image, params)
+        summary = ("These settings will change:\n\n"
+                   + "\n".join(f"{field}: {old} -> {new}" for field, (old, new) in changes.items()))
+
+    # A queued job may still change the device, so only skip when idle
+    if changes == {} and not programming.busy:
+        scheduler.cancel("status_clear")
+        lbl_status.config(text="These settings were already sent to the pacemaker.", fg="green")
+        clear_status_later(lbl_status)
+        return False
+    if changes != {} and not messagebox.askyesno("Confirm Changes", summary + "\n\nSend them to the pacemaker?"):
+        lbl_status.config(text="Nothing was sent.", fg="#E49B0F")
+        clear_status_later(lbl_status)
+        return False
+
+    def show(job):
+        if not lbl_status.winfo_exists():
+            return
+        if job.state in (programmingQueue.PENDING, programmingQueue.IN_FLIGHT):
+            scheduler.cancel("status_clear")
+        if job.state == programmingQueue.PENDING:
+            lbl_status.config(text="Settings saved, waiting to send...", fg="#E49B0F")
+        elif job.state == programmingQueue.IN_FLIGHT:
+            lbl_status.config(text="Sending settings to the pacemaker...", fg="#E49B0F")
+        elif job.state == programmingQueue.CONFIRMED:
+            lbl_status.config(text=f"Settings saved and confirmed by the pacemaker ({job.result.latency * 1000:.0f} ms)",
+                              fg="green")
+            clear_status_later(lbl_status)
+        elif job.state == programmingQueue.SENT:
+            lbl_status.config(text="Settings saved and sent (this pacemaker can't confirm them)", fg="green")
+            clear_status_later(lbl_status)
+        elif job.state == programmingQueue.FAILED:
+            if isinstance(job.error, serialCom.VerifyError):
+                lbl_status.config(text=str(job.error) + "!", fg="#AA0000")
+            else:
+                lbl_status.config(text="Could not reach the pacemaker!", fg="#AA0000")
+
+    programming.submit(params, currPort, serial_number, show)
+    return True
+
+# Remember what each pacemaker was last programmed with. Firmware that doesn't
+# echo can't confirm it, so an unverified send is recorded as well
+def record_programmed(job):
+    device_registry.programmed(job.serial, job.params)
+
+# Parameters a pacemaker was last programmed with, None if it never has been
+def device_image(serial_number):
+    record = device_registry.get(serial_number) if serial_number is not None else None
+    return record.last_params if record is not None else None
+
+# Starting point for a settings screen: the pacemaker's last parameters,
+# so fields the screen doesn't edit keep their values, or the defaults for
+# a pacemaker the DCM hasn't programmed
+def device_params(serial_number):
+    params = defaultParams()
+    image = device_image(serial_number)
+    if image is not None:
+        params.update((field, image[field]) for field in params if field in image)
+    return params
+
+# Clears a settings screen's status message after a few seconds. Submitting
+# again restarts the wait instead of clearing the new message early
+def clear_status_later(lbl_status):
+    def clear():
+        if lbl_status.winfo_exists():
+            lbl_status.config(text="")
+
+    scheduler.once("status_clear", STATUS_CLEAR_DELAY, clear)
+
+# Add the submitted settings to the user's history, with the mode's fields by
+# name and the serial of the pacemaker they were sent to, then to the
+# searchable history of all users
+def save_settings(mode, params):
+    log = get_user_settings_log(curr_user, create=True)
+    log.append(mode, params, find_device())
+    settings_history.sync(curr_user, log)
 
 '''
 # Create windows for user input for each setting
@@ -656,7 +570,7 @@ def open_voo_pacing_settings():
     # Input validation for submission of parameters
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         # Handle the cases that the entries aren't numbers and not all filled
         try:
@@ -688,16 +602,11 @@ def open_voo_pacing_settings():
         params["vent_amp"] = va
         params["vent_pw"] = pw
 
-        # Save settings if all fields are numbers and a device is connected
-        save_settings('VOO', params)
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        
-        # sending parameters to pacemaker
-        serialCom.send_parameters(params,currPort)
- 
-        # After 3 seconds clear the message
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('VOO', params)
+
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=6, column=1, columnspan=2, pady=10)
@@ -754,7 +663,7 @@ def open_aoo_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -784,13 +693,11 @@ def open_aoo_pacing_settings():
         params["atr_amp"] = aa
         params["atr_pw"] = pw
         
-        save_settings('AOO',params)
-        # Sending parameters to pacemaker
-        serialCom.send_parameters(params,currPort)
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('AOO', params)
 
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=6, column=1, columnspan=2, pady=10)
@@ -858,7 +765,7 @@ def open_vvi_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -893,12 +800,11 @@ def open_vvi_pacing_settings():
         params["vent_sens"] = vsens
         params["vrp"] = vrp
 
-        save_settings('VVI', params)
-        serialCom.send_parameters(params,currPort)
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('VVI', params)
 
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=8, column=1, columnspan=2, pady=10)
@@ -971,7 +877,7 @@ def open_aai_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -1008,12 +914,11 @@ def open_aai_pacing_settings():
         params["arp"] = arp
         params["pvarp"] = pvarp
 
-        save_settings('AAI',params)
-        serialCom.send_parameters(params,currPort)
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('AAI', params)
 
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=9, column=1, columnspan=2, pady=10)
@@ -1104,7 +1009,7 @@ def open_voor_pacing_settings():
     # Input validation for submission of parameters
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         # Handle the cases that the entries aren't numbers and not all filled
         try:
@@ -1144,13 +1049,11 @@ def open_voor_pacing_settings():
         params["reaction_time"] = rt
         params["response_fact"] = rf
         params["recovery_time"] = rct
-        # Save settings if all fields are numbers and a device is connected
-        save_settings('VOOR', params)
-        serialCom.send_parameters(params,currPort)
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        # After 3 seconds clear the message
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('VOOR', params)
+
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=11, column=1, columnspan=2, pady=10)
@@ -1236,7 +1139,7 @@ def open_aoor_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -1275,12 +1178,11 @@ def open_aoor_pacing_settings():
         params["response_fact"] = rf
         params["recovery_time"] = rct
  
-        save_settings('AOOR', params)
-        serialCom.send_parameters(params,currPort)
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('AOOR', params)
 
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=11, column=1, columnspan=2, pady=10)
@@ -1378,7 +1280,7 @@ def open_vvir_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -1423,11 +1325,11 @@ def open_vvir_pacing_settings():
         params["response_fact"] = rf
         params["recovery_time"] = rct
  
-        save_settings('VVIR', params)
-        serialCom.send_parameters(params,currPort)
-        lbl_status.config(text="Settings have been saved!", fg="green")
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('VVIR', params)
+
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=13, column=1, columnspan=2, pady=10)
@@ -1530,7 +1432,7 @@ def open_aair_pacing_settings():
     # Handle submission validation, refer to VOO function of same name
     def handle_submit():
         current_device = find_device()
-        params = defaultParams()
+        params = device_params(current_device)
  
         try:
             lrl = int(entry_lrl.get())
@@ -1569,12 +1471,11 @@ def open_aair_pacing_settings():
         params["response_fact"] = rf
         params["recovery_time"] = rct
 
-        save_settings('AAIR', params)
-        serialCom.send_parameters(params,currPort)
-        lbl_status.config(text="Settings have been saved!", fg="green")
- 
-        root.after(3000, lambda: lbl_status.config(text=""))
- 
+        # Save the settings once the clinician has confirmed the changes and
+        # they are on their way to the pacemaker
+        if program_device(params, lbl_status):
+            save_settings('AAIR', params)
+
     # Submit button
     btn_submit = tk.Button(root, text="Submit", command=handle_submit)
     btn_submit.grid(row=14, column=1, columnspan=2, pady=10)
@@ -1594,8 +1495,15 @@ def on_login_enter_key(event):
 '''
 # Main application logic starts here
 '''
-# User database dictionary
-users_db = {}
+# Registered users, opened by load_users
+user_store = None
+
+# Settings history of each user who logged in this session, by name
+settings_logs = {}
+
+# Settings of every user in one table, for looking back by device, mode and date
+HISTORY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings_history.db')
+settings_history = settingsHistory.SettingsHistory(HISTORY_DB)
  
 # # Ready CSV to accept data
 # initialize_csv_file()
@@ -1614,6 +1522,21 @@ root.title("Pacemaker DCM")
 root.geometry("500x400")  
 root.configure(bg="#f0f0f0")
 
+# Every recurring job on the main loop: device label, status clearing,
+# egram refresh, serial results and registry writes
+scheduler = taskScheduler.Scheduler(root)
+
+# Event loop thread for device I/O, results are handed back to Tk
+bridge = asyncSerialCom.AsyncBridge()
+bridge.start()
+bridge.attach(scheduler)
+
+# Settings are sent to the pacemaker one transaction at a time
+programming = programmingQueue.ProgrammingQueue(bridge, scheduler, on_programmed=record_programmed)
+
+# Device registry changes are written in batches
+scheduler.every("registry_flush", REGISTRY_FLUSH_INTERVAL, device_registry.flush)
+
 # Welcome message
 welcome_message = tk.Label(root, text="\n\tWelcome\n", font=("Cambria", 24, "bold"), bg="#f0f0f0")
 welcome_message.grid(row=0, column=0, columnspan=3, pady=(20, 0),)  # Cente#AA0000 by columnspan
@@ -1687,4 +1610,14 @@ def show_login_screen():
     root.bind('<Return>', on_login_enter_key)
     
 # Start the main event loop
-root.mainloop()
\ No newline at end of file
+root.mainloop()
+
+# Release the pacemaker port once the DCM is closed
+programming.cancel()
+scheduler.cancel_all()
+bridge.stop()
+device_monitor.stop()
+device_registry.flush()
+user_store.close()
+settings_history.close()
+serialCom.close_sessions()
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+import queue
+import threading
+
+import serialCom
+
+'''
+# Serial transactions run off the Tk thread, so programming can be in flight
+# without blocking the GUI. Port I/O goes through the shared serialCom session
+# on worker threads: a second handle on the same port would split the
+# device's replies between two readers, and the session lock keeps them apart
+# from the egram reader. The loop runs on its own thread and AsyncBridge
+# hands finished results back to the Tk thread
+'''
+
+
+# Sends parameters and checks the device's echo, see serialCom.program_and_verify
+async def program_and_verify(params, currPort, retries=serialCom.verify_retries):
+    return await asyncio.get_running_loop().run_in_executor(None, serialCom.program_and_verify,
+                                                            params, currPort, retries)
+
+
+# Runs an event loop on a background thread. Coroutines are submitted from Tk
+# and their results come back through a queue that Tk polls
+class AsyncBridge:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.results = queue.Queue()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop.run_forever, name="dcm-asyncio", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+        self.thread = None
+
+    # Schedule a coroutine on the loop. on_done(result) or on_error(exception)
+    # is later called on the Tk thread
+    def submit(self, coro, on_done=None, on_error=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda f: self.results.put((f, on_done, on_error)))
+        return future
+
+    # Run the callbacks of finished coroutines, must be called on the Tk thread
+    def poll(self):
+        while True:
+            try:
+                future, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+                else:
+                    print(f"Background serial task failed: {error}")
+            elif on_done is not None:
+                on_done(future.result())
+
+    # Poll for results every interval ms as a job of the DCM's task scheduler
+    def attach(self, scheduler, interval=50):
+        scheduler.every("serial_results", interval, self.poll)
@@ -0,0 +1,493 @@
+import argparse
+import ast
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import serialCodec
+import serialCom
+import settingsHistory
+import settingsLog
+import userStore
+from deviceEmulator import DeviceEmulator
+from egramData import EgramData
+from globalVars import defaultParams
+
+'''
+# Benchmarks of the DCM's hot paths. Everything runs headless: serial traffic
+# goes to a virtual pacemaker on a pseudo-terminal, plots render off screen and
+# the user/settings functions run against scratch copies of the data files.
+# Results are saved as JSON so two commits can be compared with --compare
+'''
+
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
+DCM_SCRIPT = os.path.join(FOLDER_PATH, 'DCM code.py')
+RESULT_FOLDER = os.path.join(FOLDER_PATH, 'benchmark_results')
+
+# Functions pulled out of DCM code.py, which can't be imported without its GUI
+DCM_FUNCTIONS = ("get_user_csv_path", "get_user_settings_log", "load_users", "save_user", "register_user",
+                 "login_user", "save_settings", "display_current_settings")
+
+# Relative slowdown of a median reported by --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+# Median, percentiles and throughput from per call times in seconds
+def summarize(times, unit_count=1):
+    times = np.asarray(times, dtype=float)
+    median = float(np.median(times))
+    return {
+        "runs": len(times),
+        "median_us": median * 1e6,
+        "p90_us": float(np.percentile(times, 90)) * 1e6,
+        "p99_us": float(np.percentile(times, 99)) * 1e6,
+        "min_us": float(times.min()) * 1e6,
+        "max_us": float(times.max()) * 1e6,
+        "per_second": unit_count / median if median else float('inf'),
+    }
+
+# Times fn in batches of `number` calls, so cheap calls aren't lost in timer
+# overhead. Each batch gives one per call sample
+def measure(fn, number=1, repeat=50, unit_count=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return summarize(times, unit_count)
+
+
+'''
+# Protocol and data structures
+'''
+
+def bench_codec():
+    return {name: measure(case, number=2000, repeat=50)
+            for name, case in serialCodec.benchmark_cases().items()}
+
+def bench_stream_decoder(frame_samples=32, frames=256):
+    frame = bytearray()
+    for _ in range(frames):
+        body = np.uint16(frame_samples).tobytes() + np.random.rand(2 * frame_samples).astype('<f8').tobytes()
+        checksum = int(np.frombuffer(body, dtype=np.uint8).sum()) & 0xFF
+        frame += serialCom.stream_sync + body + bytes([checksum])
+    data = bytes(frame)
+
+    def decode():
+        decoder = serialCom.StreamDecoder()
+        decoder.feed(data)
+        decoder.take()
+
+    return {"decode_frames": measure(decode, repeat=50, unit_count=frames * frame_samples)}
+
+# Adding egram samples one at a time and in blocks, throughput is samples/s
+def bench_egram_data(capacity=5000, block=1000):
+    data = EgramData(capacity, 2)
+    sample = np.array([0.5, 0.25])
+    samples = np.random.rand(block, 2)
+    return {
+        "add_data": measure(lambda: data.add_data(sample), number=block, repeat=50),
+        "extend_block": measure(lambda: data.extend(samples), repeat=200, unit_count=block),
+        "get_data": measure(data.get_data, number=100, repeat=50),
+    }
+
+
+'''
+# Egram rendering, off screen with the Agg backend
+'''
+
+# The DCM's own dual egram plot with an Agg canvas in place of its Tk window
+def offscreen_plotter(history):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from egramPlot import DualEgramPlotter
+
+    class OffscreenPlotter(DualEgramPlotter):
+        def build_window(self):
+            self.canvas = FigureCanvasAgg(self.fig)
+
+    return OffscreenPlotter(None, defaultParams(), history=history)
+
+def bench_render(frames=200, history=500, block=4):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plotter = offscreen_plotter(history)
+    plotter.prepare_frames(20)
+    rng = np.random.default_rng(0)
+
+    # One frame as the live plot draws it: drain the reader, update the
+    # traces, rescale if needed and blit. The samples stay in the y range, so
+    # only the x axis sweeping forward every half window redraws everything
+    def blit_frame():
+        plotter.reader.deliver(rng.uniform(0.1, 0.9, (block, 2)))
+        plotter.draw_frame()
+
+    # A frame whose samples leave the y range, so the axes rescale and the
+    # whole figure is redrawn
+    def rescale_frame():
+        for ax in plotter.axes:
+            ax.set_ylim(0, 1)
+        plotter.reader.deliver(rng.uniform(-1, 2, (block, 2)))
+        plotter.draw_frame()
+
+    # Fill the window first so every frame draws full traces
+    for _ in range(history // block):
+        plotter.reader.deliver(rng.uniform(0.1, 0.9, (block, 2)))
+    plotter.draw_frame()
+
+    results = {
+        "blit": measure(blit_frame, repeat=frames),
+        "full_draw": measure(rescale_frame, repeat=frames // 4),
+    }
+    plt.close(plotter.fig)
+    return results
+
+
+'''
+# Serial round trips against the virtual pacemaker
+'''
+
+def bench_serial(duration=2.0):
+    # The echo command is answered here although the current firmware doesn't,
+    # so the read back and verify paths have something to time
+    emulator = DeviceEmulator(serial_number="000000999999", echo=True)
+    port = emulator.start()
+
+    # Like the firmware, no echo: programming is sent unverified after the
+    # first request times out
+    silent = DeviceEmulator(serial_number="000000999998")
+    silent_port = silent.start()
+    params = defaultParams()
+    try:
+        results = {
+            "send_parameters": measure(lambda: serialCom.send_parameters(params, port), repeat=100),
+            "read_params": measure(lambda: serialCom.read_params(params, port), repeat=100),
+            "program_and_verify": measure(lambda: serialCom.program_and_verify(params, port), repeat=100),
+            "program_unverified": measure(lambda: serialCom.program_and_verify(params, silent_port), repeat=100),
+            "get_plotData": measure(lambda: serialCom.get_plotData(params, port), repeat=200),
+        }
+
+        # Streamed samples per second, limited by the emulator's sample rate
+        decoder = serialCom.start_egram_stream(params, port)
+        if decoder is not None:
+            count = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                count += len(serialCom.read_egram_stream(decoder, port))
+            elapsed = time.perf_counter() - start
+            serialCom.stop_egram_stream(port)
+            results["stream"] = {"samples": count, "seconds": elapsed,
+                                 "per_second": count / elapsed, "dropped_bytes": decoder.dropped}
+    finally:
+        serialCom.close_sessions()
+        emulator.stop()
+        silent.stop()
+    return results
+
+
+'''
+# User and settings handling from DCM code.py
+'''
+
+# Messagebox and entry stand-ins so the DCM functions run without a display
+class Silent:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class Entry:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+# Entry giving a different name every time, for registering new users
+class NewNameEntry:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.count = 0
+
+    def get(self):
+        self.count += 1
+        return f"{self.prefix}{self.count}"
+
+# Loads the named functions of DCM code.py into a namespace whose __file__
+# is in folder, so they read and write scratch copies of the data files
+def load_dcm_functions(folder, names=DCM_FUNCTIONS):
+    with open(DCM_SCRIPT) as file:
+        tree = ast.parse(file.read(), DCM_SCRIPT)
+    tree.body = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+
+    namespace = {
+        "__file__": os.path.join(folder, 'DCM code.py'),
+        "csv": csv, "os": os, "time": time,
+        "messagebox": Silent(),
+        "userStore": userStore,
+        "settingsLog": settingsLog,
+        "user_store": None,
+        "settings_logs": {},
+        "curr_user": None,
+        "mode_picker": lambda: None,
+        "find_device": lambda: "000000000001",
+    }
+    exec(compile(tree, DCM_SCRIPT, 'exec'), namespace)
+    return namespace
+
+# Silences the progress prints of the user migration while timing it
+def quietly(fn):
+    def run():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            fn()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run
+
+def bench_users(user_counts=(10, 1000, 10000)):
+    results = {}
+    for count in user_counts:
+        with tempfile.TemporaryDirectory() as folder:
+            dcm = load_dcm_functions(folder)
+            with open(os.path.join(folder, 'users.csv'), 'w', newline='') as file:
+                csv.writer(file).writerows([f"user{i}", f"password{i}"] for i in range(count))
+
+            # The first load moves users.csv into the store, later ones just open it
+            results[f"migrate_users_{count}"] = measure(quietly(dcm["load_users"]), repeat=1)
+
+            def reload():
+                dcm["user_store"].close()
+                dcm["load_users"]()
+
+            repeat = max(5, 2000 // count)
+            results[f"load_users_{count}"] = measure(reload, repeat=repeat)
+
+            dcm["entry_name"] = Entry(f"user{count - 1}")
+            dcm["entry_password"] = Entry(f"password{count - 1}")
+            results[f"login_user_{count}"] = measure(dcm["login_user"], repeat=200)
+
+            dcm["entry_name"] = NewNameEntry("new_user")
+            results[f"register_user_{count}"] = measure(dcm["register_user"], repeat=200)
+            dcm["user_store"].close()
+    return results
+
+def bench_settings(history_lengths=(1000, 10000, 100000)):
+    results = {}
+    params = defaultParams()
+    params.update(mode=4, rate_adapt=1)
+    for length in history_lengths:
+        with tempfile.TemporaryDirectory() as folder:
+            dcm = load_dcm_functions(folder)
+            dcm["curr_user"] = "bench"
+            dcm["settings_history"] = settingsHistory.SettingsHistory(os.path.join(folder, 'settings_history.db'))
+            os.makedirs(os.path.join(folder, 'user_csvs'))
+
+            # A history saved by an older DCM, moved into the log on first use
+            history = os.path.join(folder, 'user_csvs', 'bench.csv')
+            with open(history, 'w', newline='') as file:
+                csv.writer(file).writerows([0, 4, 1, 60, 120, 1.0, 20, 4, 250, 120, 0.5, 30, 10, 30]
+                                           for _ in range(length))
+            results[f"migrate_settings_{length}"] = measure(quietly(lambda: dcm["get_user_settings_log"]("bench")),
+                                                            repeat=1)
+
+            results[f"save_settings_{length}"] = measure(lambda: dcm["save_settings"]('VVIR', params), repeat=200)
+            results[f"display_current_settings_{length}"] = measure(dcm["display_current_settings"],
+                                                                    repeat=max(5, 200000 // length))
+            dcm["settings_history"].close()
+    return results
+
+# Queries a history browser makes: the newest page, a page deep into the
+# history, one device's VVIR changes over a month and one field's time series
+def bench_history(entries=100000, devices=20, users=5):
+    results = {}
+    modes = list(settingsLog.MODE_FIELDS)
+    rng = np.random.default_rng(0)
+    start = 1.7e9
+    with tempfile.TemporaryDirectory() as folder:
+        history = settingsHistory.SettingsHistory(os.path.join(folder, 'settings_history.db'))
+        logs = []
+        for user in range(users):
+            log = settingsLog.SettingsLog(os.path.join(folder, f'user{user}.jsonl'))
+            params = defaultParams()
+            batch = []
+            for number in range(entries // users):
+                mode = modes[rng.integers(len(modes))]
+                params.update(mode=settingsHistory.MODE_NUMBERS[mode], lrl=int(rng.integers(30, 90)))
+                batch.append(settingsLog.make_entry(mode, params, f"device{rng.integers(devices)}",
+                                                    start + (number * users + user) * 60))
+            log.extend(batch)
+            logs.append((f"user{user}", log))
+
+        def sync_all():
+            for user, log in logs:
+                history.sync(user, log)
+
+        results[f"sync_{entries}"] = measure(sync_all, repeat=1, unit_count=entries)
+        results["sync_no_changes"] = measure(sync_all, repeat=200)
+
+        end = start + entries * 60
+        results["query_newest_page"] = measure(history.query, repeat=200)
+        results["query_deep_page"] = measure(lambda: history.query(before=(start + (end - start) / 10, 0)),
+                                             repeat=200)
+        month = (start + (end - start) / 2, start + (end - start) / 2 + 30 * 86400)
+        results["query_device_mode_month"] = measure(
+            lambda: history.query(device="device3", mode="VVIR", start=month[0], end=month[1]), repeat=200)
+        results["series_lrl_device"] = measure(lambda: history.series("lrl", device="device3"), repeat=20)
+        history.close()
+    return results
+
+
+'''
+# Cold startup of the DCM
+'''
+
+# Run in a fresh interpreter: the DCM script up to its first idle main window
+STARTUP_RUNNER = '''
+import sys, time, tkinter
+start = time.perf_counter()
+def first_frame(self, n=0):
+    self.update()
+    print(time.perf_counter() - start)
+    self.destroy()
+tkinter.Tk.mainloop = first_frame
+sys.argv = [sys.argv[1]]
+exec(compile(open(sys.argv[0]).read(), sys.argv[0], 'exec'), {"__name__": "__main__", "__file__": sys.argv[0]})
+'''
+
+IMPORT_RUNNER = '''
+import time
+start = time.perf_counter()
+import serialCom, asyncSerialCom, egramPlot, egramRecord, egramViewer, globalVars
+print(time.perf_counter() - start)
+'''
+
+def timed_runs(code, args=(), repeat=5, cwd=FOLDER_PATH):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code, *args], cwd=cwd,
+                                capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1:]
+        times.append(time.perf_counter() - start)
+    return times, None
+
+def bench_startup(repeat=5):
+    results = {}
+    times, error = timed_runs(IMPORT_RUNNER, repeat=repeat)
+    results["module_imports"] = summarize(times) if times else {"skipped": error}
+
+    # Needs a display for the Tk window. The DCM keeps its data next to its
+    # script, so it runs from a copy to leave the source folder untouched
+    with tempfile.TemporaryDirectory() as folder:
+        for name in os.listdir(FOLDER_PATH):
+            if name.endswith('.py'):
+                shutil.copy(os.path.join(FOLDER_PATH, name), folder)
+        script = os.path.join(folder, os.path.basename(DCM_SCRIPT))
+        times, error = timed_runs(STARTUP_RUNNER, [script], repeat=repeat, cwd=folder)
+    results["dcm_first_window"] = summarize(times) if times else {"skipped": error}
+    return results
+
+
+'''
+# Running and comparing
+'''
+
+SUITES = {
+    "codec": bench_codec,
+    "stream_decoder": bench_stream_decoder,
+    "egram_data": bench_egram_data,
+    "render": bench_render,
+    "serial": bench_serial,
+    "users": bench_users,
+    "settings": bench_settings,
+    "history": bench_history,
+    "startup": bench_startup,
+}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=FOLDER_PATH,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(suites=SUITES):
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "suites": {},
+    }
+    for name in suites:
+        print(f"Running {name}...", flush=True)
+        results["suites"][name] = SUITES[name]()
+    return results
+
+# Flattened {suite/case: median} of a results file
+def medians(results):
+    return {f"{suite}/{case}": stats["median_us"]
+            for suite, cases in results["suites"].items()
+            for case, stats in cases.items() if "median_us" in stats}
+
+# Prints every median of new against old, flagging slowdowns past the threshold
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = medians(json.load(file))
+    with open(new_path) as file:
+        new = medians(json.load(file))
+
+    regressions = 0
+    for case in sorted(old.keys() & new.keys()):
+        change = new[case] / old[case] - 1 if old[case] else 0.0
+        flag = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+        regressions += bool(flag)
+        print(f"{case:48} {old[case]:12.2f} {new[case]:12.2f} us {change:+7.1%}{flag}")
+    return regressions
+
+def print_results(results):
+    for suite, cases in results["suites"].items():
+        for case, stats in cases.items():
+            if "median_us" in stats:
+                print(f"{suite + '/' + case:48} median {stats['median_us']:12.2f} us"
+                      f"  p90 {stats['p90_us']:12.2f} us  {stats['per_second']:14.1f}/s")
+            else:
+                print(f"{suite + '/' + case:48} {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DCM's hot paths")
+    parser.add_argument("suites", nargs="*", help=f"suites to run, default all of: {', '.join(SUITES)}")
+    parser.add_argument("--output", help="results file, default benchmark_results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = run(args.suites or SUITES)
+    print_results(results)
+
+    output = args.output or os.path.join(RESULT_FOLDER, f"{results['commit'] or 'results'}.json")
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved {output}")
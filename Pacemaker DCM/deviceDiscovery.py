@@ -0,0 +1,191 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+import serialCom
+
+'''
+# Pacemaker discovery. Ports are only enumerated when something changes: on
+# Linux an inotify watch on /dev (where udev creates the J-Link's tty node)
+# and on the virtual port folder wakes the monitor, elsewhere it polls. The
+# result is kept in one DeviceState the GUI reads without touching the ports
+'''
+
+# Text in a port description that identifies the pacemaker's J-Link
+DEVICE_DESCRIPTION = "JLink"
+
+# Folders watched for serial ports appearing or disappearing, the virtual
+# port folder only when emulated pacemakers are turned on
+WATCHED_FOLDERS = ("/dev",) + ((serialCom.VIRTUAL_PORT_FOLDER,) if serialCom.VIRTUAL_PORT_FOLDER else ())
+
+# udev creates the node then sets it up, wait for it to settle before listing
+SETTLE_TIME = 0.2
+
+# Rescan this often even when no event arrived, in case one was missed
+SAFETY_INTERVAL = 30.0
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+inotify_event = struct.Struct('iIII')
+
+
+# Retrieve the unique device serial number from a port's hardware ID
+def get_serial(hwid):
+    for section in hwid.split():
+        if section.startswith("SER="):
+            return section.split('=')[1]  # Get the value after "SER="
+    return None
+
+
+# The connected pacemaker as last seen, never changed in place so readers on
+# any thread get a consistent snapshot
+class DeviceState:
+    def __init__(self, serial=None, port=None, description=None):
+        self.serial = serial
+        self.port = port
+        self.description = description
+
+    @property
+    def connected(self):
+        return self.serial is not None
+
+    def __eq__(self, other):
+        return (self.serial, self.port) == (other.serial, other.port)
+
+    def __repr__(self):
+        return f"DeviceState({self.serial!r}, {self.port!r})"
+
+
+# Returns the state for the first pacemaker among ports
+def find_pacemaker(ports):
+    for port in ports:
+        if DEVICE_DESCRIPTION in port.description:
+            return DeviceState(get_serial(port.hwid), port.device, port.description)
+    return DeviceState()
+
+
+# inotify watch on a set of folders through libc, None where unavailable
+class FolderWatch:
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for folder in folders:
+            if libc.inotify_add_watch(self.fd, folder.encode(), WATCH_MASK) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"cannot watch {folder}")
+
+    @classmethod
+    def open(cls, folders):
+        if not hasattr(os, "O_CLOEXEC") or not os.path.isdir("/dev"):
+            return None
+        try:
+            return cls(folders)
+        except (OSError, AttributeError):
+            return None
+
+    def close(self):
+        os.close(self.fd)
+
+    # Waits up to timeout for events, returns the names that changed
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        names = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = inotify_event.unpack_from(data, offset)
+            offset += inotify_event.size
+            names.append(data[offset:offset + length].rstrip(b'\0').decode(errors='replace'))
+            offset += length
+        return names
+
+
+# Only tty nodes and port registrations matter, /dev sees plenty of other traffic
+def relevant(name):
+    return name.startswith("tty") or name.startswith("cu.") or name.endswith(".json")
+
+
+# Keeps `state` up to date on a background thread. `version` goes up on
+# every change, so the GUI can tell cheaply whether there is anything new
+class DeviceMonitor:
+    def __init__(self, poll_interval=1.0, watch=True):
+        self.poll_interval = poll_interval
+        self.watch = watch
+        self.state = DeviceState()
+        self.version = 0
+        self.scans = 0
+
+        # "inotify" or "polling", set by start()
+        self.method = None
+
+        self.thread = None
+        self.running = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        # The first scan is done here so state is valid as soon as start returns
+        self.rescan()
+        if serialCom.VIRTUAL_PORT_FOLDER and not os.path.exists(serialCom.VIRTUAL_PORT_FOLDER):
+            os.makedirs(serialCom.VIRTUAL_PORT_FOLDER, exist_ok=True)
+        watch = FolderWatch.open(WATCHED_FOLDERS) if self.watch else None
+        self.method = "inotify" if watch is not None else "polling"
+
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, args=(watch,), name="device-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+    # Lists the ports once and publishes the result if it changed
+    def rescan(self):
+        state = find_pacemaker(serialCom.list_ports())
+        with self.lock:
+            self.scans += 1
+            if state != self.state:
+                self.state = state
+                self.version += 1
+        return state
+
+    def run(self, watch):
+        if watch is None:
+            while self.running.is_set():
+                time.sleep(self.poll_interval)
+                self.rescan()
+            return
+
+        try:
+            last_scan = time.monotonic()
+            while self.running.is_set():
+                # Short waits so stop() doesn't hang on a quiet system
+                names = watch.wait(0.5)
+                if any(relevant(name) for name in names):
+                    time.sleep(SETTLE_TIME)
+                    watch.wait(0)
+                    self.rescan()
+                    last_scan = time.monotonic()
+                elif time.monotonic() - last_scan > SAFETY_INTERVAL:
+                    self.rescan()
+                    last_scan = time.monotonic()
+        finally:
+            watch.close()
@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+import numpy as np
+
+import serialCodec
+import serialCom
+from globalVars import defaultParams
+
+'''
+# Virtual pacemaker for running the DCM without a board. It opens a Linux
+# pseudo-terminal, answers the Simulink model's set-parameters (0x13) and
+# egram request (0x47) commands, and registers itself so the DCM's port
+# discovery lists it like a J-Link port. Two things differ from the current
+# firmware: it streams egram frames (0x48/0x49), which the DCM falls back
+# from on boards that don't, and with echo=True it answers the echo command
+# (0x22), which the firmware's ECHO_PARAM state doesn't. Leave echo off to
+# see what the DCM does with real hardware
+'''
+
+DESCRIPTION = "JLink CDC UART Port (virtual)"
+
+# AV delay used by the synthetic egram, in seconds
+AV_DELAY = 0.15
+
+
+# Synthetic atrial and ventricular signals at the given times in seconds.
+# Each beat is a pulse in the paced chamber(s) on a small noisy baseline
+def synthetic_egram(times, params, noise=0.02):
+    period = 60.0 / max(params["lrl"], 1)
+    phase = np.mod(times, period)
+
+    atr = np.where(phase < params["atr_pw"] / 1000.0, params["atr_amp"], 0.0)
+    vent_phase = phase - AV_DELAY
+    vent = np.where((vent_phase >= 0) & (vent_phase < params["vent_pw"] / 1000.0), params["vent_amp"], 0.0)
+
+    atr = atr + np.random.normal(0, noise, len(times))
+    vent = vent + np.random.normal(0, noise, len(times))
+    return atr, vent
+
+
+# One emulated pacemaker. Call start() and point the DCM at `port`
+class DeviceEmulator:
+    def __init__(self, serial_number="000000900001", sample_rate=1000, frame_samples=32,
+                 latency=0.0, drop_rate=0.0, streaming=True, echo=False):
+        self.serial_number = serial_number
+        self.params = defaultParams()
+
+        # Egram generation: samples per second and samples per stream frame
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+
+        # Faults: seconds before each reply, chance each sent byte is lost
+        self.latency = latency
+        self.drop_rate = drop_rate
+
+        # False behaves like older firmware that only answers egram requests
+        self.streaming_supported = streaming
+        self.streaming = False
+
+        # Answer the echo command with the held parameters, the firmware doesn't
+        self.echo = echo
+
+        self.master = None
+        self.port = None
+        self.thread = None
+        self.running = threading.Event()
+        self.start_time = time.monotonic()
+        self.samples_sent = 0
+
+        # Counters for tests and benchmarks
+        self.packets = 0
+        self.bytes_dropped = 0
+
+    # Where the port is registered for discovery, None unless DCM_VIRTUAL_PORTS is set
+    def registration_path(self):
+        if not serialCom.VIRTUAL_PORT_FOLDER:
+            return None
+        return os.path.join(serialCom.VIRTUAL_PORT_FOLDER, f"{self.serial_number}.json")
+
+    # Open a new pseudo-terminal and list it for port discovery
+    def open_port(self):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        # Keep the slave open so the pty survives between DCM connections
+        self.slave = slave
+
+        if self.registration_path() is None:
+            return
+        if not os.path.exists(serialCom.VIRTUAL_PORT_FOLDER):
+            os.makedirs(serialCom.VIRTUAL_PORT_FOLDER)
+        with open(self.registration_path(), 'w') as file:
+            json.dump({
+                "device": self.port,
+                "description": DESCRIPTION,
+                "hwid": f"USB VID:PID=1366:1015 SER={self.serial_number}",
+            }, file)
+
+    def close_port(self):
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+        path = self.registration_path()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def start(self):
+        self.open_port()
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name="pacemaker-emulator", daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+        self.close_port()
+
+    # Simulate the board being unplugged. The port disappears, and after
+    # `duration` seconds a new one appears with the same serial number
+    def disconnect(self, duration=1.0):
+        self.stop()
+        def plug_back_in():
+            time.sleep(duration)
+            self.start()
+        threading.Thread(target=plug_back_in, daemon=True).start()
+
+    # Write to the DCM, losing bytes at the configured drop rate
+    def send(self, data):
+        if self.drop_rate:
+            data = bytearray(data)
+            for i in reversed(range(len(data))):
+                if random.random() < self.drop_rate:
+                    del data[i]
+                    self.bytes_dropped += 1
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def reply(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send(data)
+
+    # Device loop: answers commands and pushes stream frames on time
+    def run(self):
+        buffer = bytearray()
+        packet_size = serialCodec.command_packet.size
+        frame_period = self.frame_samples / self.sample_rate
+        next_frame = time.monotonic()
+
+        while self.running.is_set():
+            wait = max(next_frame - time.monotonic(), 0) if self.streaming else 0.05
+            readable, _, _ = select.select([self.master], [], [], wait)
+            if readable:
+                try:
+                    buffer += os.read(self.master, 4096)
+                except OSError:
+                    # Nothing has the slave open right now
+                    time.sleep(0.01)
+
+            # Resync on the first byte, then handle every complete packet
+            while buffer:
+                if buffer[0] != serialCodec.firstByte:
+                    del buffer[0]
+                    continue
+                if len(buffer) < packet_size:
+                    break
+                self.handle(bytes(buffer[:packet_size]))
+                del buffer[:packet_size]
+
+            if self.streaming and time.monotonic() >= next_frame:
+                self.send_frame()
+                next_frame += frame_period
+                if next_frame < time.monotonic():
+                    next_frame = time.monotonic() + frame_period
+
+    def handle(self, packet):
+        command, params = serialCodec.decode_command(packet)
+        self.packets += 1
+
+        if command == serialCom.send:
+            self.params = params
+        elif command == serialCom.echo and self.echo:
+            atr, vent = self.current_sample()
+            self.reply(serialCodec.encode_echo(self.params, atr))
+        elif command == serialCom.egram_request:
+            self.reply(serialCodec.egram_sample.pack(*self.current_sample()))
+        elif command == serialCom.start_stream and self.streaming_supported:
+            self.streaming = True
+            self.samples_sent = int((time.monotonic() - self.start_time) * self.sample_rate)
+        elif command == serialCom.stop_stream:
+            self.streaming = False
+
+    def current_sample(self):
+        atr, vent = synthetic_egram(np.array([time.monotonic() - self.start_time]), self.params)
+        return float(atr[0]), float(vent[0])
+
+    # Push the next frame_samples samples as one stream frame
+    def send_frame(self):
+        n = self.frame_samples
+        times = (self.samples_sent + np.arange(n)) / self.sample_rate
+        self.samples_sent += n
+        atr, vent = synthetic_egram(times, self.params)
+
+        body = struct.pack('<H', n) + np.concatenate([atr, vent]).astype('<f8').tobytes()
+        checksum = int(np.frombuffer(body, dtype=np.uint8).sum()) & 0xFF
+        self.send(serialCom.stream_sync + body + bytes([checksum]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a virtual pacemaker on a pseudo-terminal")
+    parser.add_argument("--serial", default="000000900001", help="serial number reported to the DCM")
+    parser.add_argument("--rate", type=int, default=1000, help="egram samples per second")
+    parser.add_argument("--frame", type=int, default=32, help="samples per stream frame")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument("--drop", type=float, default=0.0, help="chance each sent byte is lost")
+    parser.add_argument("--no-stream", action="store_true", help="behave like firmware without streaming")
+    parser.add_argument("--echo", action="store_true",
+                        help="answer the echo command, which the current firmware doesn't")
+    args = parser.parse_args()
+
+    emulator = DeviceEmulator(args.serial, args.rate, args.frame, args.latency, args.drop,
+                              streaming=not args.no_stream, echo=args.echo)
+    print(f"Virtual pacemaker {args.serial} on {emulator.start()}")
+    if emulator.registration_path() is None:
+        print("DCM_VIRTUAL_PORTS isn't set, so the DCM won't find this pacemaker. "
+              "Set it to the same folder for both to connect them")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
@@ -0,0 +1,154 @@
+import csv
+import json
+import os
+import threading
+import time
+
+'''
+# Every pacemaker the DCM has seen, indexed by serial number. devices.csv is
+# read once at startup into a dict; after that lookups never touch the disk.
+# Changes are queued as events and appended to the file in batches by flush().
+# Old files with one serial per row load as devices with no history
+'''
+
+# Event rows: serial, event, unix time, JSON data. A row with only a serial
+# just records that the device is known
+SEEN = "seen"           # Device connected
+LEFT = "left"           # Device disconnected
+PROGRAMMED = "programmed"
+SNAPSHOT = "snapshot"   # Whole record, written when the log is compacted
+
+# Rewrite the log as one snapshot per device once it has this many rows per device
+COMPACT_RATIO = 8
+
+
+# What is known about one pacemaker
+class DeviceRecord:
+    def __init__(self, serial):
+        self.serial = serial
+        self.first_seen = None
+        self.last_seen = None
+        self.connections = 0
+        self.last_programmed = None
+        self.last_params = None
+
+    def to_dict(self):
+        return {"first_seen": self.first_seen, "last_seen": self.last_seen,
+                "connections": self.connections, "last_programmed": self.last_programmed,
+                "last_params": self.last_params}
+
+    # Replays one event from the log
+    def apply(self, event, when, data):
+        if event == SNAPSHOT:
+            for key, value in data.items():
+                setattr(self, key, value)
+            return
+        if when is not None:
+            if self.first_seen is None:
+                self.first_seen = when
+            self.last_seen = when
+        if event == SEEN:
+            self.connections += 1
+        elif event == PROGRAMMED:
+            self.last_programmed = when
+            self.last_params = data
+
+
+class DeviceRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.devices = {}
+        self.pending = []
+        self.rows = 0
+        self.lock = threading.Lock()
+
+        # Serial of the device connected right now, see observe()
+        self.current = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, mode='r', newline='') as file:
+            for row in csv.reader(file):
+                if not row:
+                    continue
+                self.rows += 1
+                record = self.record(row[0])
+                if len(row) >= 4:
+                    when = float(row[2]) if row[2] else None
+                    record.apply(row[1], when, json.loads(row[3]) if row[3] else None)
+
+        if self.devices and self.rows > COMPACT_RATIO * len(self.devices):
+            self.compact()
+
+    # The record for serial, created if it isn't known yet
+    def record(self, serial):
+        record = self.devices.get(serial)
+        if record is None:
+            record = DeviceRecord(serial)
+            self.devices[serial] = record
+        return record
+
+    def get(self, serial):
+        return self.devices.get(serial)
+
+    def __contains__(self, serial):
+        return serial in self.devices
+
+    def __len__(self):
+        return len(self.devices)
+
+    # Applies an event in memory and queues it for the next flush
+    def log(self, serial, event, data=None):
+        when = time.time()
+        with self.lock:
+            record = self.record(serial)
+            record.apply(event, when, data)
+            self.pending.append([serial, event, f"{when:.3f}", json.dumps(data) if data is not None else ""])
+        return record
+
+    # Adds a device without counting a connection
+    def add(self, serial):
+        with self.lock:
+            if serial in self.devices:
+                return self.devices[serial]
+            self.pending.append([serial])
+            return self.record(serial)
+
+    # Called with the connected serial (or None) whenever discovery reports a
+    # change. Counts the connection and stamps when the last device left
+    def observe(self, serial):
+        if serial == self.current:
+            return
+        if self.current is not None:
+            self.log(self.current, LEFT)
+        self.current = serial
+        if serial is not None:
+            self.log(serial, SEEN)
+
+    def programmed(self, serial, params):
+        if serial is not None:
+            self.log(serial, PROGRAMMED, dict(params))
+
+    # Appends the queued events in one write
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            rows, self.pending = self.pending, []
+            self.rows += len(rows)
+            with open(self.path, mode='a', newline='') as file:
+                csv.writer(file).writerows(rows)
+
+    # Rewrites the log as one snapshot row per device
+    def compact(self):
+        with self.lock:
+            temp_path = self.path + '.tmp'
+            with open(temp_path, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                for serial, record in self.devices.items():
+                    writer.writerow([serial, SNAPSHOT, "", json.dumps(record.to_dict())])
+            os.replace(temp_path, self.path)
+            self.rows = len(self.devices)
+            self.pending = []
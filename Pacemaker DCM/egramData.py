@@ -0,0 +1,97 @@
+import numpy as np
+
+'''
+# Fixed capacity storage for egram samples. Samples live in a preallocated
+# NumPy ring buffer so adding data never allocates, however long the history
+'''
+
+# Collections of egram data will be considered objects
+class EgramData:
+
+    # Construct object, capacity is the number of samples kept per channel
+    def __init__(self, capacity=20, channels=1):
+        self.capacity = capacity
+        self.channels = channels
+
+        # Manage labelling x axis when no timestamp is given
+        self.counter = 0
+
+        # Column 0 is the timestamp, then one column per channel. Every row is
+        # written twice, at i and i + capacity, so the newest `capacity` rows
+        # are always one contiguous slice and can be viewed without copying
+        self.buffer = np.zeros((2 * capacity, channels + 1))
+        self.head = 0   # Row the next sample goes into
+        self.size = 0   # Number of valid samples
+
+    def __len__(self):
+        return self.size
+
+    # Setter. Take a datapoint and store it in place of the oldest one
+    def add_data(self, voltage, timestamp=None):
+        if timestamp is None:
+            timestamp = self.counter
+        self.counter += 1
+
+        row = self.buffer[self.head]
+        row[0] = timestamp
+        row[1:] = voltage
+        self.buffer[self.head + self.capacity] = row
+
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    # Add a batch of samples at once, voltages is (n,) or (n, channels)
+    def extend(self, voltages, timestamps=None):
+        voltages = np.asarray(voltages, dtype=float).reshape(-1, self.channels)
+        n = len(voltages)
+        if n == 0:
+            return
+
+        if timestamps is None:
+            timestamps = np.arange(self.counter, self.counter + n)
+        else:
+            timestamps = np.asarray(timestamps, dtype=float)
+        self.counter += n
+
+        # Only the newest `capacity` samples of a large batch would survive anyway
+        if n > self.capacity:
+            skipped = n - self.capacity
+            voltages = voltages[skipped:]
+            timestamps = timestamps[skipped:]
+            self.head = (self.head + skipped) % self.capacity
+            n = self.capacity
+
+        # Fill up to the end of the ring, then wrap around to the start
+        first = min(n, self.capacity - self.head)
+        self.write_rows(self.head, timestamps[:first], voltages[:first])
+        if first < n:
+            self.write_rows(0, timestamps[first:], voltages[first:])
+
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    # Copy a run of rows into both halves of the buffer
+    def write_rows(self, start, timestamps, voltages):
+        end = start + len(timestamps)
+        for offset in (0, self.capacity):
+            self.buffer[start + offset:end + offset, 0] = timestamps
+            self.buffer[start + offset:end + offset, 1:] = voltages
+
+    # Oldest to newest samples as a view into the buffer, no data is copied
+    def view(self):
+        end = self.head + self.capacity
+        return self.buffer[end - self.size:end]
+
+    # Empty the buffer without reallocating it
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.counter = 0
+
+    # Getter for data, returns views of the timestamps and voltages
+    def get_data(self):
+        rows = self.view()
+        if self.channels == 1:
+            return rows[:, 0], rows[:, 1]
+        return rows[:, 0], rows[:, 1:]
@@ -0,0 +1,277 @@
+import time
+import tkinter as tk
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from egramData import EgramData
+from egramRecord import EgramRecorder, new_recording_path
+from egramStream import EgramReader
+import perfStats
+
+'''
+# Egram plot windows. The trace artists are created once and only their data
+# changes each frame, blitting redraws the trace area instead of the whole figure
+'''
+
+# Extra room added around the data when the y axis has to grow
+Y_MARGIN = 0.1
+
+render_time = perfStats.histogram("egram.render")
+frame_interval = perfStats.histogram("egram.frame_interval")
+late_frames = perfStats.counter("egram.late_frames")
+
+
+# Window layout shared by the live plots and the recording viewer: a
+# matplotlib figure embedded in its own Tk window with an exit button
+class EgramWindow:
+    # Number of traces drawn
+    channels = 2
+
+    # Number of stacked axes sharing the time axis. With one axes every
+    # channel is drawn on it, otherwise each channel gets its own
+    panels = 1
+    channel_names = ("Atrium", "Ventricle")
+
+    # Initial y axis range
+    ylim = (0, 1)
+
+    def __init__(self, title):
+        # Initialize plot
+        self.fig, axes = plt.subplots(self.panels, 1, sharex=True, squeeze=False)
+        self.axes = list(axes[:, 0])
+        self.ax = self.axes[0]
+        self.title = title
+        self.closed = False
+
+        # Format plot once, these never change between frames
+        if self.panels == 1:
+            self.ax.set_title(self.title)
+        else:
+            self.fig.suptitle(self.title)
+            for ax, name in zip(self.axes, self.channel_names):
+                ax.set_title(name, fontsize='medium')
+        for ax in self.axes:
+            ax.set_ylabel('Voltage(V)')
+            ax.set_ylim(*self.ylim)
+        self.axes[-1].tick_params(axis='x', labelrotation=45)
+
+        # One line per channel, only their data changes afterwards
+        self.lines = [self.channel_axes(index).plot([], [])[0] for index in range(self.channels)]
+        self.build_window()
+
+    # The Tk window around the figure. Subclasses add their controls here, and
+    # an off screen plot (see dcmBenchmark) replaces it with a bare Agg canvas
+    def build_window(self):
+        self.window = tk.Tk()
+        self.window.title(self.title)
+        self.window.protocol("WM_DELETE_WINDOW", self.close_window)
+
+        # Embed the Matplotlib figure in the Tkinter window
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.window)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+        # Add the exit button
+        self.exit_button = tk.Button(self.window, text="Exit", command=self.close_window)
+        self.exit_button.pack(side=tk.BOTTOM)
+
+    # Axes a channel is drawn on
+    def channel_axes(self, index):
+        return self.axes[index] if self.panels > 1 else self.ax
+
+    # Closes the window
+    def close_window(self):
+        self.closed = True
+        self.window.destroy()
+
+
+# Live plot of both channels of the reply, fed by a background reader
+class EgramPlotter(EgramWindow):
+    channels = 2
+
+    def __init__(self, title, currPort, params, sample_rate=100, history=500, device=None):
+        self.data = EgramData(history, self.channels)
+
+        # Samples are read on a background thread, each frame only drains them
+        self.reader = EgramReader(currPort, params, sample_rate)
+        self.timer = None
+
+        # Figure without the traces, saved after every full draw and restored
+        # under them each frame, one per axes
+        self.backgrounds = None
+
+        # Frame period in ms and when the last frame started, for the frame stats
+        self.interval = None
+        self.last_frame = None
+
+        # Serial number of the connected pacemaker, saved in recordings
+        self.device = device
+        self.params = params
+        self.recorder = None
+
+        super().__init__(title)
+        self.ax.set_xlim(0, history)
+
+    def build_window(self):
+        super().build_window()
+
+        # Add the record button
+        self.record_button = tk.Button(self.window, text="Record", command=self.toggle_recording)
+        self.record_button.pack(side=tk.BOTTOM)
+
+    # Start writing every acquired sample to disk, or stop if already recording
+    def toggle_recording(self):
+        if self.recorder is None:
+            self.recorder = EgramRecorder(new_recording_path(self.device), self.device,
+                                          self.params, self.reader.sample_rate)
+            self.recorder.start()
+            self.reader.add_sink(self.recorder.write)
+            self.record_button.config(text="Stop Recording", fg="#AA0000")
+        else:
+            self.stop_recording()
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.reader.remove_sink(self.recorder.write)
+            self.recorder.stop()
+            self.recorder = None
+            self.record_button.config(text="Record", fg="black")
+
+    # Closes egram plot window, the serial session stays open for the rest of the DCM
+    def close_window(self):
+        """Close the graph window and stop acquiring samples."""
+        if self.timer is not None:
+            self.timer.stop()
+        self.reader.stop()
+        self.stop_recording()
+        super().close_window()
+
+    # Pull the samples that arrived since the last frame into the ring buffer
+    def read_samples(self):
+        self.data.extend(self.reader.drain())
+
+    # Move the axes only when the data has left them. Returns True if they moved
+    def rescale(self, timestamps, voltages):
+        if len(timestamps) == 0:
+            return False
+        changed = False
+
+        # Sweep the x axis forward half a window at a time rather than every frame
+        xmin, xmax = self.ax.get_xlim()
+        if timestamps[-1] > xmax:
+            span = xmax - xmin
+            xmin = timestamps[-1] - span / 2
+            self.ax.set_xlim(xmin, xmin + span)
+            changed = True
+
+        voltages = voltages.reshape(len(timestamps), -1)
+        for ax in self.axes:
+            columns = [index for index in range(self.channels)
+                       if self.channel_axes(index) is ax and self.lines[index].get_visible()]
+            if not columns:
+                continue
+
+            ymin, ymax = ax.get_ylim()
+            low, high = voltages[:, columns].min(), voltages[:, columns].max()
+            if low < ymin or high > ymax:
+                low, high = min(low, ymin), max(high, ymax)
+                margin = (high - low) * Y_MARGIN
+                ax.set_ylim(low - margin, high + margin)
+                changed = True
+
+        return changed
+
+    # A full draw leaves out the animated traces: keep what it drew as the
+    # background, then draw the traces over it
+    def save_background(self, event):
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+        for line in self.lines:
+            line.axes.draw_artist(line)
+
+    # Redraw only the trace area of each axes over its saved background
+    def blit(self):
+        for ax, background in zip(self.axes, self.backgrounds):
+            self.canvas.restore_region(background)
+            for line in self.lines:
+                if line.axes is ax:
+                    ax.draw_artist(line)
+            self.canvas.blit(ax.bbox)
+
+    # This generates each frame of animation, timed from pulling samples to
+    # the end of the blit
+    def draw_frame(self):
+        start = time.perf_counter()
+        if self.last_frame is not None:
+            elapsed = start - self.last_frame
+            frame_interval.record(elapsed)
+            # A frame that came more than one interval late was effectively dropped
+            if elapsed > 2 * self.interval / 1000.0:
+                late_frames.add()
+        self.last_frame = start
+
+        with render_time.time():
+            self.update_lines()
+            self.blit()
+
+    def update_lines(self):
+        self.read_samples()
+        timestamps, voltages = self.data.get_data()
+
+        for index, line in enumerate(self.lines):
+            if line.get_visible():
+                line.set_data(timestamps, voltages[:, index])
+
+        # New limits mean new ticks, which live outside the blitted area, so
+        # redraw the static parts once and let the next frames blit over them
+        if self.rescale(timestamps, voltages):
+            self.canvas.draw()
+
+    # Draws the static parts once and sets up blitting the traces over them,
+    # after this each draw_frame() call redraws one frame
+    def prepare_frames(self, interval):
+        self.interval = interval
+        for line in self.lines:
+            line.set_animated(True)
+        self.canvas.mpl_connect('draw_event', self.save_background)
+        self.canvas.draw()
+
+    # Redraw every interval ms. event_source is an optional matplotlib timer
+    # driving the frames instead of the figure's own
+    def start_animation(self, interval, event_source=None):
+        self.reader.start()
+        self.prepare_frames(interval)
+        self.timer = event_source if event_source is not None else self.canvas.new_timer(interval=interval)
+        self.timer.add_callback(self.draw_frame)
+        self.timer.start()
+        self.window.mainloop()
+
+
+# Both chambers in one window, stacked on a shared time axis and fed by a
+# single reader. Each channel can be hidden without touching the port
+class DualEgramPlotter(EgramPlotter):
+    channels = 2
+    panels = 2
+
+    def __init__(self, currPort, params, sample_rate=100, history=500, device=None):
+        # Initialize from the parent class
+        super().__init__("Electrogram", currPort, params, sample_rate, history, device)
+
+    def build_window(self):
+        super().build_window()
+
+        # One check box per channel
+        toggles = tk.Frame(self.window)
+        toggles.pack(side=tk.BOTTOM)
+        self.shown = []
+        for index, name in enumerate(self.channel_names):
+            shown = tk.BooleanVar(master=self.window, value=True)
+            box = tk.Checkbutton(toggles, text=name, variable=shown,
+                                 command=lambda index=index: self.toggle_channel(index))
+            box.pack(side=tk.LEFT, padx=10)
+            self.shown.append(shown)
+
+    # Show or hide a channel's axes, acquisition carries on for both
+    def toggle_channel(self, index):
+        visible = self.shown[index].get()
+        self.lines[index].set_visible(visible)
+        self.channel_axes(index).set_visible(visible)
+        self.canvas.draw()
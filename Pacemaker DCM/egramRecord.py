@@ -0,0 +1,194 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+'''
+# Recording egram sessions to disk. Samples are written as fixed width records
+# after a small header so a recording can be opened with numpy.memmap, however
+# long it is. A sidecar index holds the sample number at every index interval
+'''
+
+FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
+RECORD_FOLDER = os.path.join(FOLDER_PATH, 'recordings')
+
+# File starts with the magic, the header length, then the JSON header padded
+# out to HEADER_SIZE bytes. Samples start right after it
+MAGIC = b'DCMEGRM1'
+HEADER_SIZE = 4096
+header_prefix = struct.Struct('<8sI')
+
+# One record per sample, atrium and ventricle voltage
+record_dtype = np.dtype([('atrium', '<f8'), ('ventricle', '<f8')])
+
+# One index entry per INDEX_INTERVAL seconds: first sample at or after that time
+index_dtype = np.dtype([('sample', '<u8'), ('time', '<f8')])
+INDEX_INTERVAL = 1.0
+
+# Recordings are flushed to disk at least this often
+FLUSH_INTERVAL = 1.0
+
+
+# Paths of the sample file and its index
+def index_path(path):
+    return path + '.idx'
+
+# Default file name for a new recording of a device
+def new_recording_path(device=None):
+    if not os.path.exists(RECORD_FOLDER):
+        os.makedirs(RECORD_FOLDER)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return os.path.join(RECORD_FOLDER, f"{device or 'unknown'}_{stamp}.egram")
+
+def write_header(file, header):
+    body = json.dumps(header).encode('utf-8')
+    if header_prefix.size + len(body) > HEADER_SIZE:
+        raise ValueError("Recording header is too large")
+    file.write(header_prefix.pack(MAGIC, len(body)))
+    file.write(body)
+    file.write(b'\0' * (HEADER_SIZE - header_prefix.size - len(body)))
+
+def read_header(path):
+    with open(path, 'rb') as file:
+        prefix = file.read(header_prefix.size)
+        magic, length = header_prefix.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an egram recording")
+        return json.loads(file.read(length).decode('utf-8'))
+
+
+# Writes every block of samples it is given to a recording from a background
+# thread. Pass write as a sink to an EgramReader
+class EgramRecorder:
+    def __init__(self, path, device, params, sample_rate):
+        self.path = path
+        self.start_time = time.time()
+        self.header = {
+            "device": device,
+            "params": dict(params),
+            "sample_rate": sample_rate,
+            "start_time": self.start_time,
+            "index_interval": INDEX_INTERVAL,
+            "channels": list(record_dtype.names),
+        }
+
+        self.blocks = queue.Queue()
+        self.samples_written = 0
+        self.next_index = 0
+        self.thread = None
+
+    def start(self):
+        self.data_file = open(self.path, 'wb')
+        write_header(self.data_file, self.header)
+        self.index_file = open(index_path(self.path), 'wb')
+
+        self.thread = threading.Thread(target=self.run, name="egram-recorder", daemon=True)
+        self.thread.start()
+
+    # Called from the acquisition thread, only queues the block
+    def write(self, block):
+        self.blocks.put((time.time(), block))
+
+    # Waits for every queued block to reach the disk, then closes the files
+    def stop(self):
+        if self.thread is None:
+            return
+        self.blocks.put(None)
+        self.thread.join()
+        self.thread = None
+
+    # Writer loop, runs until stop() queues None
+    def run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self.blocks.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    item = False
+
+                if item is None:
+                    break
+                if item:
+                    self.write_block(*item)
+
+                if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self.data_file.flush()
+                    self.index_file.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self.data_file.close()
+            self.index_file.close()
+
+    def write_block(self, arrived, block):
+        # Index entries for every interval boundary passed before this block
+        elapsed = arrived - self.start_time
+        while self.next_index * INDEX_INTERVAL <= elapsed:
+            entry = np.array([(self.samples_written, arrived)], dtype=index_dtype)
+            self.index_file.write(entry.tobytes())
+            self.next_index += 1
+
+        records = np.empty(len(block), dtype=record_dtype)
+        records['atrium'] = block[:, 0]
+        records['ventricle'] = block[:, 1]
+        self.data_file.write(records.tobytes())
+        self.samples_written += len(block)
+
+
+# Read only view of a recording. Samples and index are memory mapped, nothing
+# is loaded until it is accessed
+class EgramRecording:
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.sample_rate = self.header["sample_rate"]
+        self.start_time = self.header["start_time"]
+        self.index_interval = self.header["index_interval"]
+
+        # A recording still being written may end part way through a record
+        count = (os.path.getsize(path) - HEADER_SIZE) // record_dtype.itemsize
+        if count:
+            self.samples = np.memmap(path, dtype=record_dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.samples = np.empty(0, dtype=record_dtype)
+
+        idx = index_path(path)
+        entries = os.path.getsize(idx) // index_dtype.itemsize if os.path.exists(idx) else 0
+        if entries:
+            self.index = np.memmap(idx, dtype=index_dtype, mode='r', shape=(entries,))
+        else:
+            self.index = np.empty(0, dtype=index_dtype)
+
+    def __len__(self):
+        return len(self.samples)
+
+    # Length of the recording in seconds
+    def duration(self):
+        if len(self.index):
+            return len(self.index) * self.index_interval
+        return len(self.samples) / self.sample_rate if self.sample_rate else 0.0
+
+    # Sample number at a time in seconds from the start, found from the index
+    # entry for that interval without searching
+    def seek(self, seconds):
+        if not len(self.index):
+            return min(max(int(seconds * self.sample_rate), 0), len(self.samples))
+        entry = int(seconds // self.index_interval)
+        if entry < 0:
+            return 0
+        if entry >= len(self.index):
+            return len(self.samples)
+        return int(self.index['sample'][entry])
+
+    # Samples between two times in seconds from the start
+    def window(self, start, end):
+        return self.samples[self.seek(start):self.seek(end)]
+
+    def close(self):
+        self.samples = None
+        self.index = None
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import serial
+
+import perfStats
+import serialCom
+
+samples_read = perfStats.counter("egram.samples")
+dropped_blocks = perfStats.counter("egram.dropped_blocks")
+
+'''
+# Background acquisition of egram samples. The reader thread talks to the
+# pacemaker at its own rate and the plot windows only drain what has arrived
+'''
+
+# Reads egram samples on a dedicated thread and buffers them for the GUI
+class EgramReader:
+    def __init__(self, currPort, params, sample_rate=100, max_pending=10000, stream=True):
+        self.port = currPort
+        self.params = params
+
+        # Samples per second to request when polling, 0 reads as fast as the
+        # device replies. A streaming device sends at its own rate
+        self.sample_rate = sample_rate
+
+        # Try the streaming protocol first, fall back to polling if unsupported
+        self.stream = stream
+        self.streaming = False
+
+        # Blocks of (n, 2) samples. deque appends and pops are thread safe,
+        # oldest blocks are dropped if the GUI stops draining for a while
+        self.samples = deque(maxlen=max_pending)
+
+        # Callables given every block as it arrives, e.g. a recorder
+        self.sinks = []
+
+        self.thread = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name=f"egram-{self.port}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    # Also hands every block the reader acquires to sink(block)
+    def add_sink(self, sink):
+        self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        self.sinks = [s for s in self.sinks if s is not sink]
+
+    # Queue a block for the GUI and pass it to the sinks
+    def deliver(self, block):
+        samples_read.add(len(block))
+        if len(self.samples) == self.samples.maxlen:
+            dropped_blocks.add()
+        self.samples.append(block)
+        for sink in self.sinks:
+            sink(block)
+
+    # Acquisition loop, runs until stop() is called
+    def run(self):
+        if self.stream:
+            try:
+                decoder = serialCom.start_egram_stream(self.params, self.port)
+            except (serial.SerialException, OSError):
+                decoder = None
+            if decoder is not None:
+                self.streaming = True
+                try:
+                    self.run_stream(decoder)
+                finally:
+                    self.streaming = False
+                    try:
+                        serialCom.stop_egram_stream(self.port)
+                    except (serial.SerialException, OSError):
+                        pass
+                return
+
+        self.run_polling()
+
+    # Reads frames the device pushes on its own
+    def run_stream(self, decoder):
+        while self.running.is_set():
+            try:
+                samples = serialCom.read_egram_stream(decoder, self.port)
+            except (serial.SerialException, OSError):
+                # Board unplugged, reconnect and ask it to stream again
+                time.sleep(1)
+                try:
+                    decoder = serialCom.start_egram_stream(self.params, self.port) or decoder
+                except (serial.SerialException, OSError):
+                    pass
+                continue
+
+            if len(samples):
+                self.deliver(samples)
+
+    # Requests one sample at a time for firmware without streaming
+    def run_polling(self):
+        period = 1.0 / self.sample_rate if self.sample_rate else 0
+        next_time = time.monotonic()
+
+        while self.running.is_set():
+            try:
+                voltages = serialCom.get_plotData(self.params, self.port)
+            except (serial.SerialException, OSError):
+                # Board unplugged, wait before the session tries to reopen it
+                time.sleep(1)
+                next_time = time.monotonic()
+                continue
+
+            if voltages is not None:
+                self.deliver(np.array([voltages]))
+
+            if period:
+                next_time += period
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind, don't try to catch up with a burst of requests
+                    next_time = time.monotonic()
+
+    # Returns every sample that arrived since the last call as an (n, 2)
+    # array of (atrium, ventricle) rows
+    def drain(self):
+        blocks = []
+        while True:
+            try:
+                blocks.append(self.samples.popleft())
+            except IndexError:
+                break
+
+        if not blocks:
+            return np.empty((0, 2))
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks)
@@ -0,0 +1,199 @@
+import os
+import tkinter as tk
+
+import numpy as np
+
+from egramPlot import EgramWindow
+from egramRecord import EgramRecording
+
+'''
+# Replay of recorded egram sessions. A min/max pyramid is computed once per
+# recording so any zoom level draws at most about two points per pixel column
+'''
+
+# Samples per bucket at the first pyramid level, and growth between levels
+LOD_BASE = 16
+LOD_FACTOR = 4
+
+# Samples reduced per step while building the first level, bounds memory use
+BUILD_CHUNK = LOD_BASE * 65536
+
+# Zoom applied by the buttons and the mouse wheel
+ZOOM_STEP = 2.0
+
+
+# Reduce every `factor` rows of values to one row with fn, keeping a partial last bucket
+def reduce_rows(values, factor, fn):
+    full = len(values) // factor * factor
+    out = fn(values[:full].reshape(-1, factor, values.shape[1]), axis=1)
+    if full < len(values):
+        out = np.concatenate([out, fn(values[full:], axis=0, keepdims=True)])
+    return out
+
+
+# Min and max of each channel over buckets of growing size. Level k covers
+# LOD_BASE * LOD_FACTOR**k samples per bucket
+class MinMaxPyramid:
+    def __init__(self, buckets, mins, maxs):
+        self.buckets = buckets
+        self.mins = mins
+        self.maxs = maxs
+
+    # Builds the pyramid from a recording's samples, reading the memory map in chunks
+    @classmethod
+    def build(cls, samples):
+        mins, maxs = [], []
+        for start in range(0, len(samples), BUILD_CHUNK):
+            chunk = samples[start:start + BUILD_CHUNK]
+            values = np.column_stack([chunk[name] for name in samples.dtype.names]).astype(np.float32)
+            mins.append(reduce_rows(values, LOD_BASE, np.min))
+            maxs.append(reduce_rows(values, LOD_BASE, np.max))
+
+        if not mins:
+            return cls([], [], [])
+
+        buckets = [LOD_BASE]
+        mins = [np.concatenate(mins)]
+        maxs = [np.concatenate(maxs)]
+        while len(mins[-1]) > 1:
+            buckets.append(buckets[-1] * LOD_FACTOR)
+            mins.append(reduce_rows(mins[-1], LOD_FACTOR, np.min))
+            maxs.append(reduce_rows(maxs[-1], LOD_FACTOR, np.max))
+        return cls(buckets, mins, maxs)
+
+    # Pyramid of a recording, from its cache file if that is newer than the data
+    @classmethod
+    def for_recording(cls, recording):
+        cache = recording.path + '.lod.npz'
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(recording.path):
+            with np.load(cache) as saved:
+                levels = len(saved['buckets'])
+                return cls(list(saved['buckets']),
+                           [saved[f'min{k}'] for k in range(levels)],
+                           [saved[f'max{k}'] for k in range(levels)])
+
+        pyramid = cls.build(recording.samples)
+        arrays = {'buckets': np.array(pyramid.buckets)}
+        for k in range(len(pyramid.buckets)):
+            arrays[f'min{k}'] = pyramid.mins[k]
+            arrays[f'max{k}'] = pyramid.maxs[k]
+        np.savez(cache, **arrays)
+        return pyramid
+
+    # Points to draw for samples [start, end) using at most max_points per
+    # channel. Returns sample positions and an (n, channels) array
+    def query(self, samples, start, end, max_points):
+        span = end - start
+        if span <= max_points or not self.buckets:
+            window = samples[start:end]
+            values = np.column_stack([window[name] for name in samples.dtype.names])
+            return np.arange(start, end), values
+
+        # Finest level that still fits, each bucket is drawn as its min and max
+        level = len(self.buckets) - 1
+        for k, bucket in enumerate(self.buckets):
+            if span / bucket * 2 <= max_points:
+                level = k
+                break
+
+        bucket = self.buckets[level]
+        first = start // bucket
+        last = min(-(-end // bucket), len(self.mins[level]))
+        count = last - first
+
+        positions = np.empty(2 * count)
+        positions[0::2] = np.arange(first, last) * bucket
+        positions[1::2] = positions[0::2] + bucket / 2
+        values = np.empty((2 * count, self.mins[level].shape[1]))
+        values[0::2] = self.mins[level][first:last]
+        values[1::2] = self.maxs[level][first:last]
+        return positions, values
+
+
+# Window for scrolling and zooming through a recording
+class EgramViewer(EgramWindow):
+    def __init__(self, path, span=10.0):
+        self.recording = EgramRecording(path)
+        self.pyramid = MinMaxPyramid.for_recording(self.recording)
+        self.duration = max(self.recording.duration(), 1.0 / max(self.recording.sample_rate, 1))
+
+        # Seconds shown across the window, and the time at its left edge
+        self.span = min(span, self.duration)
+        self.start = 0.0
+
+        device = self.recording.header.get("device") or "unknown device"
+        super().__init__(f"Egram Recording - {device}")
+        self.ax.set_xlabel('Time(s)')
+        self.ax.legend(self.lines, self.recording.header["channels"], loc='upper right')
+
+        # Position slider, zoom buttons and a box to jump to a time
+        controls = tk.Frame(self.window)
+        controls.pack(side=tk.BOTTOM, fill=tk.X)
+        self.position = tk.Scale(controls, from_=0, to=self.duration, resolution=0.01,
+                                 orient=tk.HORIZONTAL, showvalue=False, command=self.on_scroll)
+        self.position.pack(side=tk.TOP, fill=tk.X)
+        tk.Button(controls, text="Zoom In", command=lambda: self.zoom(1 / ZOOM_STEP)).pack(side=tk.LEFT)
+        tk.Button(controls, text="Zoom Out", command=lambda: self.zoom(ZOOM_STEP)).pack(side=tk.LEFT)
+        tk.Label(controls, text="Go to (s):").pack(side=tk.LEFT, padx=(10, 0))
+        self.entry_time = tk.Entry(controls, width=10)
+        self.entry_time.pack(side=tk.LEFT)
+        tk.Button(controls, text="Go", command=self.go_to).pack(side=tk.LEFT)
+
+        self.canvas.mpl_connect('scroll_event', self.on_wheel)
+        self.show(0.0)
+
+    # Time in seconds from the start of the recording for sample positions
+    def sample_times(self, positions):
+        index = self.recording.index
+        if len(index) > 1:
+            times = index['time'] - self.recording.start_time
+            return np.interp(positions, index['sample'], times)
+        return positions / self.recording.sample_rate
+
+    # Draw the window starting at a time in seconds
+    def show(self, start):
+        self.start = min(max(start, 0.0), max(self.duration - self.span, 0.0))
+        end = self.start + self.span
+
+        first = self.recording.seek(self.start)
+        last = max(self.recording.seek(end), first)
+        width = max(self.canvas.get_tk_widget().winfo_width(), 200)
+        positions, values = self.pyramid.query(self.recording.samples, first, last, 2 * width)
+
+        times = self.sample_times(positions)
+        for index, line in enumerate(self.lines):
+            line.set_data(times, values[:, index])
+
+        self.ax.set_xlim(self.start, end)
+        if len(values):
+            low, high = float(values.min()), float(values.max())
+            margin = (high - low) * 0.1 or 0.1
+            self.ax.set_ylim(low - margin, high + margin)
+        self.canvas.draw_idle()
+
+    # Change the visible span around the middle of the window
+    def zoom(self, factor):
+        middle = self.start + self.span / 2
+        self.span = min(max(self.span * factor, 10.0 / max(self.recording.sample_rate, 1)), self.duration)
+        self.show(middle - self.span / 2)
+
+    def on_scroll(self, value):
+        self.show(float(value))
+
+    def on_wheel(self, event):
+        self.zoom(1 / ZOOM_STEP if event.button == 'up' else ZOOM_STEP)
+
+    def go_to(self):
+        try:
+            seconds = float(self.entry_time.get())
+        except ValueError:
+            return
+        self.position.set(seconds)
+        self.show(seconds)
+
+    def close_window(self):
+        self.recording.close()
+        super().close_window()
+
+    def run(self):
+        self.window.mainloop()
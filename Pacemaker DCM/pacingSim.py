@@ -0,0 +1,272 @@
+import itertools
+import time
+
+import numpy as np
+
+from globalVars import defaultParams
+
+'''
+# Offline model of the pacing timing in the Simulink model, for checking
+# parameter choices before programming a device. A whole grid of parameter
+# sets is stepped beat by beat together, every step being NumPy operations
+# across the grid, so hours of virtual time take seconds
+'''
+
+# Pacing mode numbers sent in params["mode"], see the settings screens
+MODES = {
+    "AOO": (1, 0), "VOO": (2, 0), "AAI": (3, 0), "VVI": (4, 0),
+    "AOOR": (1, 1), "VOOR": (2, 1), "AAIR": (3, 1), "VVIR": (4, 1),
+}
+ATRIAL_MODES = (1, 3)
+INHIBITED_MODES = (3, 4)
+
+# Event kinds in the simulated event stream
+PACE = 1
+SENSE = 2
+
+# Response factor that maps to the full LRL..MSR range while running
+MAX_RESPONSE_FACTOR = 16
+
+
+# Params for one mode with any fields overridden
+def mode_params(mode, **fields):
+    params = defaultParams()
+    params["mode"], params["rate_adapt"] = MODES[mode]
+    params.update(fields)
+    return params
+
+# Every combination of the given field values applied to base, e.g.
+# param_grid(mode_params("VVI"), lrl=range(50, 90, 10), vrp=[250, 320])
+def param_grid(base, **ranges):
+    names = list(ranges)
+    sets = []
+    for values in itertools.product(*[ranges[name] for name in names]):
+        params = dict(base)
+        params.update(zip(names, values))
+        sets.append(params)
+    return sets
+
+
+# Intrinsic heart activity fed to the simulation: event times in seconds and
+# their amplitudes for each chamber, in the same units as atr_sens / vent_sens
+class IntrinsicRhythm:
+    def __init__(self, atrial_times, atrial_amps, vent_times, vent_amps):
+        self.atrial_times = np.asarray(atrial_times, dtype=float)
+        self.atrial_amps = np.asarray(atrial_amps, dtype=float)
+        self.vent_times = np.asarray(vent_times, dtype=float)
+        self.vent_amps = np.asarray(vent_amps, dtype=float)
+
+    # No intrinsic activity at all, the pacemaker paces every beat
+    @classmethod
+    def none(cls):
+        return cls([], [], [], [])
+
+    # Sinus rhythm at rate bpm with beat to beat variability, conducted to the
+    # ventricle after av_delay. dropout is the chance a beat isn't conducted
+    @classmethod
+    def sinus(cls, duration, rate, av_delay=0.15, amplitude=5.0, variability=0.05, dropout=0.0, seed=0):
+        rng = np.random.default_rng(seed)
+        count = int(duration * rate / 60) + 1
+        intervals = 60.0 / rate * (1 + rng.normal(0, variability, count))
+        atrial = np.cumsum(np.clip(intervals, 0.2, None))
+        atrial = atrial[atrial < duration]
+        conducted = rng.random(len(atrial)) >= dropout
+        vent = atrial[conducted] + av_delay
+        amps = amplitude * (1 + rng.normal(0, 0.1, len(atrial)))
+        return cls(atrial, amps, vent, amps[conducted])
+
+
+# Activity level for each second of the simulation, e.g. an accelerometer
+# magnitude. Segments are (start s, end s, level)
+def activity_profile(duration, segments=()):
+    activity = np.zeros(int(np.ceil(duration)) + 1)
+    for start, end, level in segments:
+        activity[int(start):int(end)] = level
+    return activity
+
+
+# Gather one field from every parameter set into an array
+def field(param_sets, name):
+    return np.array([params[name] for params in param_sets], dtype=float)
+
+
+# Pacing rate in bpm for every second and parameter set, shape (seconds, sets).
+# Rate adaptive sets follow the sensor like the rate charts in the model: the
+# activity picks a desired rate, and the current rate steps towards it once a
+# second by (MSR - LRL) / reaction_time going up, / recovery_time coming down
+def sensor_rates(param_sets, activity):
+    lrl = field(param_sets, "lrl")
+    msr = np.maximum(field(param_sets, "msr"), lrl)
+    threshold = field(param_sets, "act_thresh")
+    adaptive = field(param_sets, "rate_adapt") == 1
+    running = np.clip(field(param_sets, "response_fact") / MAX_RESPONSE_FACTOR, 0, 1)
+    rate_up = (msr - lrl) / np.maximum(field(param_sets, "reaction_time"), 1)
+    rate_down = (msr - lrl) / np.maximum(field(param_sets, "recovery_time"), 1)
+
+    rates = np.empty((len(activity), len(param_sets)))
+    current = lrl.copy()
+    for second, level in enumerate(activity):
+        fraction = np.where(level >= 2 * threshold, 1.0, np.where(level >= threshold, running, 0.0))
+        desired = lrl + (msr - lrl) * fraction
+        current = current + np.clip(desired - current, -rate_down, rate_up)
+        rates[second] = np.where(adaptive, current, lrl)
+    return rates
+
+
+# Simulate every parameter set over duration seconds
+def simulate(param_sets, duration, intrinsic=None, activity=None):
+    intrinsic = intrinsic or IntrinsicRhythm.none()
+    if activity is None:
+        activity = activity_profile(duration)
+    count = len(param_sets)
+    sets = np.arange(count)
+
+    mode = field(param_sets, "mode")
+    atrial = np.isin(mode, ATRIAL_MODES)
+    inhibited = np.isin(mode, INHIBITED_MODES)
+    refractory = np.where(atrial, field(param_sets, "arp"), field(param_sets, "vrp")) / 1000.0
+    sensitivity = np.where(atrial, field(param_sets, "atr_sens"), field(param_sets, "vent_sens"))
+    rates = sensor_rates(param_sets, activity)
+    last_second = len(rates) - 1
+
+    # Intrinsic events of each set's own chamber, padded with a never reached event
+    padded_times = [np.append(intrinsic.atrial_times, np.inf), np.append(intrinsic.vent_times, np.inf)]
+    padded_amps = [np.append(intrinsic.atrial_amps, np.inf), np.append(intrinsic.vent_amps, np.inf)]
+
+    def next_intrinsic(after):
+        index = np.where(atrial, np.searchsorted(padded_times[0], after),
+                         np.searchsorted(padded_times[1], after))
+        # Skip events too small to be sensed, usually none
+        while True:
+            times = np.where(atrial, padded_times[0][np.minimum(index, len(padded_times[0]) - 1)],
+                             padded_times[1][np.minimum(index, len(padded_times[1]) - 1)])
+            amps = np.where(atrial, padded_amps[0][np.minimum(index, len(padded_amps[0]) - 1)],
+                            padded_amps[1][np.minimum(index, len(padded_amps[1]) - 1)])
+            missed = np.isfinite(times) & (amps < sensitivity)
+            if not missed.any():
+                return times
+            index = index + missed
+
+    event_times, event_kinds = [], []
+    last = np.zeros(count)
+    active = np.ones(count, dtype=bool)
+
+    while active.any():
+        rate = rates[np.minimum(last.astype(int), last_second), sets]
+        escape = last + 60.0 / rate
+
+        # Inhibited modes reset the escape timer on an intrinsic event sensed
+        # after the refractory period, otherwise the chamber is paced
+        sensed = inhibited & active
+        if sensed.any():
+            intrinsic_next = next_intrinsic(last + refractory)
+            sensed &= intrinsic_next < escape
+            upcoming = np.where(sensed, intrinsic_next, escape)
+        else:
+            upcoming = escape
+
+        active &= upcoming < duration
+        event_times.append(np.where(active, upcoming, np.nan))
+        event_kinds.append(np.where(active, np.where(sensed, SENSE, PACE), 0))
+        last = np.where(active, upcoming, last)
+
+    # One row per set, padded with NaN / 0 after its last event
+    times = np.array(event_times[:-1]).T if len(event_times) > 1 else np.empty((count, 0))
+    kinds = np.array(event_kinds[:-1]).T if len(event_kinds) > 1 else np.empty((count, 0), dtype=int)
+    return SimulationResult(param_sets, duration, times, kinds, intrinsic, rates)
+
+
+# Pace and sense events of a simulated grid, with summaries and synthetic egrams
+class SimulationResult:
+    def __init__(self, param_sets, duration, times, kinds, intrinsic, rates):
+        self.param_sets = param_sets
+        self.duration = duration
+        self.times = times
+        self.kinds = kinds
+        self.intrinsic = intrinsic
+        self.rates = rates
+
+    # Event times and kinds of one parameter set
+    def events(self, index):
+        valid = self.kinds[index] != 0
+        return self.times[index][valid], self.kinds[index][valid]
+
+    # Per set counts and rates as arrays
+    def summary(self):
+        paces = (self.kinds == PACE).sum(axis=1)
+        senses = (self.kinds == SENSE).sum(axis=1)
+        beats = paces + senses
+        urls = field(self.param_sets, "url")
+        intervals = np.diff(self.times, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fastest = 60.0 / np.nanmin(np.where(intervals > 0, intervals, np.nan), axis=1, initial=np.inf)
+        return {
+            "paces": paces,
+            "senses": senses,
+            "percent_paced": np.where(beats, 100.0 * paces / np.maximum(beats, 1), 0.0),
+            "mean_rate": beats * 60.0 / self.duration,
+            "max_rate": fastest,
+            "above_url": fastest > urls,
+        }
+
+    # Synthetic (times, atrial, ventricular) egram of one set at sample_rate.
+    # Paces are square pulses of the programmed amplitude and width, intrinsic
+    # depolarizations are short biphasic deflections
+    def egram(self, index, sample_rate=1000, start=0.0, end=None, noise=0.0, seed=0):
+        params = self.param_sets[index]
+        end = self.duration if end is None else end
+        t = np.arange(start, end, 1.0 / sample_rate)
+
+        atr = depolarization(t, self.intrinsic.atrial_times, self.intrinsic.atrial_amps)
+        vent = depolarization(t, self.intrinsic.vent_times, self.intrinsic.vent_amps)
+
+        event_times, kinds = self.events(index)
+        paces = event_times[kinds == PACE]
+        if params["mode"] in ATRIAL_MODES:
+            atr += pulses(t, paces, params["atr_amp"], params["atr_pw"] / 1000.0)
+        else:
+            vent += pulses(t, paces, params["vent_amp"], params["vent_pw"] / 1000.0)
+
+        if noise:
+            rng = np.random.default_rng(seed)
+            atr += rng.normal(0, noise, len(t))
+            vent += rng.normal(0, noise, len(t))
+        return t, atr, vent
+
+
+# Time since the most recent event for every sample, inf before the first
+def time_since(t, event_times):
+    index = np.searchsorted(event_times, t, side='right') - 1
+    since = t - event_times[np.maximum(index, 0)] if len(event_times) else np.full(len(t), np.inf)
+    return np.where(index >= 0, since, np.inf), np.maximum(index, 0)
+
+def pulses(t, event_times, amplitude, width):
+    since, _ = time_since(t, event_times)
+    return np.where(since < width, amplitude, 0.0)
+
+def depolarization(t, event_times, amplitudes):
+    if not len(event_times):
+        return np.zeros(len(t))
+    since, index = time_since(t, event_times)
+    shape = np.exp(-((since - 0.01) / 0.004) ** 2) - 0.4 * np.exp(-((since - 0.03) / 0.008) ** 2)
+    return np.where(np.isfinite(since), amplitudes[index] * shape, 0.0)
+
+
+if __name__ == "__main__":
+    hours = 2
+    duration = hours * 3600
+    grid = (param_grid(mode_params("VVI"), lrl=range(40, 100, 5), vrp=[150, 250, 320]) +
+            param_grid(mode_params("VVIR"), lrl=range(40, 100, 5), act_thresh=[0.5, 1.0]))
+    rhythm = IntrinsicRhythm.sinus(duration, 70, dropout=0.2)
+    activity = activity_profile(duration, [(600, 1800, 0.7), (3000, 3300, 1.5)])
+
+    started = time.perf_counter()
+    result = simulate(grid, duration, rhythm, activity)
+    elapsed = time.perf_counter() - started
+
+    summary = result.summary()
+    print(f"{len(grid)} parameter sets, {hours} h each, in {elapsed:.2f} s")
+    for params, paced, rate in zip(grid, summary["percent_paced"], summary["mean_rate"]):
+        mode = [name for name, value in MODES.items() if value == (params["mode"], params["rate_adapt"])][0]
+        print(f"{mode:5} lrl={params['lrl']:3} vrp={params['vrp']:3} thresh={params['act_thresh']:.1f}"
+              f"  paced {paced:5.1f}%  mean rate {rate:5.1f} bpm")
@@ -0,0 +1,225 @@
+import json
+import math
+import threading
+import time
+import tkinter as tk
+from tkinter import filedialog
+
+'''
+# Timers and counters for the DCM's hot paths. Histograms have fixed log
+# spaced buckets so recording a value is a few arithmetic operations and
+# never allocates. Updates aren't locked, a count may be lost when two
+# threads record the same histogram at the same instant
+'''
+
+# Histogram buckets per doubling, and the smallest value kept apart (1 us)
+BUCKETS_PER_OCTAVE = 4
+SMALLEST = 1e-6
+BUCKET_COUNT = 40 * BUCKETS_PER_OCTAVE
+
+# Percentiles shown and dumped for every histogram
+PERCENTILES = (50, 90, 99)
+
+started = time.monotonic()
+
+
+# Distribution of durations in seconds (or any positive value)
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        if value > SMALLEST:
+            bucket = min(int(math.log2(value / SMALLEST) * BUCKETS_PER_OCTAVE) + 1, BUCKET_COUNT - 1)
+        else:
+            bucket = 0
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    # Upper edge of the bucket holding the given percentile, clamped to the
+    # largest value seen
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(SMALLEST * 2 ** (bucket / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def snapshot(self):
+        result = {"count": self.count,
+                  "mean": self.total / self.count if self.count else 0.0,
+                  "min": self.min if self.count else 0.0,
+                  "max": self.max}
+        for percent in PERCENTILES:
+            result[f"p{percent}"] = self.percentile(percent)
+        return result
+
+    # Times the enclosed block
+    def time(self):
+        return Timer(self)
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+# Running total, e.g. bytes or samples
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def reset(self):
+        self.value = 0
+
+    def add(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return {"total": self.value,
+                "per_second": self.value / max(time.monotonic() - started, 1e-9)}
+
+
+histograms = {}
+counters = {}
+registry_lock = threading.Lock()
+
+# Returns the named histogram, created on first use. Callers look these up
+# once and keep them, so recording skips the dictionary
+def histogram(name):
+    with registry_lock:
+        if name not in histograms:
+            histograms[name] = Histogram(name)
+        return histograms[name]
+
+def counter(name):
+    with registry_lock:
+        if name not in counters:
+            counters[name] = Counter(name)
+        return counters[name]
+
+def reset():
+    global started
+    with registry_lock:
+        for stat in list(histograms.values()) + list(counters.values()):
+            stat.reset()
+        started = time.monotonic()
+
+def snapshot():
+    with registry_lock:
+        return {
+            "uptime": time.monotonic() - started,
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "histograms": {name: stat.snapshot() for name, stat in sorted(histograms.items())},
+            "counters": {name: stat.snapshot() for name, stat in sorted(counters.items())},
+        }
+
+# Saves everything collected so far as JSON
+def dump(path):
+    with open(path, 'w') as file:
+        json.dump(snapshot(), file, indent=2)
+
+
+# Formats a duration in seconds with a readable unit
+def format_time(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.0f} us"
+
+
+# Live view of every histogram and counter, refreshed twice a second by the
+# DCM's task scheduler, whose jobs are listed too
+class DiagnosticsWindow:
+    refresh_interval = 500
+
+    def __init__(self, root, scheduler):
+        self.scheduler = scheduler
+        self.window = tk.Toplevel(root)
+        self.window.title("DCM Diagnostics")
+        self.window.protocol("WM_DELETE_WINDOW", self.close_window)
+        self.closed = False
+
+        # Closed by its own buttons or along with root when the DCM exits
+        self.window.bind("<Destroy>", self.on_destroy)
+
+        # Counter totals at the last refresh, for their recent rate
+        self.last_totals = {}
+        self.last_refresh = time.monotonic()
+
+        self.text = tk.Text(self.window, width=96, height=30, font=("Courier", 9))
+        self.text.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+        buttons = tk.Frame(self.window)
+        buttons.pack(side=tk.BOTTOM)
+        tk.Button(buttons, text="Dump to File", command=self.dump_to_file).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Reset", command=reset).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Exit", command=self.close_window).pack(side=tk.LEFT, padx=5)
+
+        self.scheduler.every("diagnostics", self.refresh_interval, self.refresh, delay=0)
+
+    def report(self):
+        stats = snapshot()
+        now = time.monotonic()
+        elapsed = max(now - self.last_refresh, 1e-9)
+        self.last_refresh = now
+        lines = [f"Uptime {format_time(stats['uptime'])}", "",
+                 f"{'Timer':28}{'count':>8}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}"]
+        for name, stat in stats["histograms"].items():
+            lines.append(f"{name:28}{stat['count']:8}" +
+                         "".join(f"{format_time(stat[key]):>12}" for key in ("p50", "p90", "p99", "max")))
+        lines += ["", f"{'Counter':28}{'total':>14}{'per second':>14}{'average/s':>14}"]
+        for name, stat in stats["counters"].items():
+            recent = (stat['total'] - self.last_totals.get(name, stat['total'])) / elapsed
+            self.last_totals[name] = stat['total']
+            lines.append(f"{name:28}{stat['total']:14}{recent:14.1f}{stat['per_second']:14.1f}")
+        lines += [""] + self.scheduler.describe()
+        return "\n".join(lines)
+
+    def refresh(self):
+        self.text.delete('1.0', tk.END)
+        self.text.insert(tk.END, self.report())
+
+    def dump_to_file(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=".json",
+                                            initialfile=f"dcm-stats-{time.strftime('%Y%m%d-%H%M%S')}.json",
+                                            filetypes=[("JSON", "*.json")])
+        if path:
+            dump(path)
+
+    def on_destroy(self, event):
+        if event.widget is self.window:
+            self.closed = True
+            self.scheduler.cancel("diagnostics")
+
+    def close_window(self):
+        self.window.destroy()
+
+    def lift(self):
+        self.window.lift()
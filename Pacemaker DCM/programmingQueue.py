@@ -0,0 +1,120 @@
+import time
+
+import asyncSerialCom
+import perfStats
+
+'''
+# Programming requests from the settings screens, sent one at a time on the
+# background event loop. A submit waits briefly before it is sent, and any
+# submit made while one is waiting or in flight replaces the waiting one, so
+# a burst of clicks becomes a single transaction with the last values.
+# Progress is reported on the Tk thread through the bridge's result queue
+'''
+
+# States reported to a job's listener
+PENDING = "pending"         # Waiting to be sent
+IN_FLIGHT = "in flight"     # Being sent to the pacemaker
+CONFIRMED = "confirmed"     # The pacemaker echoed back every value sent
+SENT = "sent, unverified"   # Sent to firmware that doesn't echo, nothing to check against
+FAILED = "failed"
+SUPERSEDED = "superseded"   # Replaced by a later submit before it was sent
+
+# Time a submit waits for another before it is sent, in ms
+COALESCE_DELAY = 150
+
+programming_latency = perfStats.histogram("programming.latency")
+coalesced = perfStats.counter("programming.coalesced")
+failures = perfStats.counter("programming.failures")
+
+
+# One programming request. listener(job) is called on the Tk thread every
+# time its state changes
+class ProgrammingJob:
+    def __init__(self, params, port, serial, listener=None):
+        self.params = dict(params)
+        self.port = port
+        self.serial = serial
+        self.listener = listener
+        self.state = None
+        self.result = None
+        self.error = None
+        self.submitted = time.monotonic()
+        self.finished = None
+
+    @property
+    def latency(self):
+        return None if self.finished is None else self.finished - self.submitted
+
+    def set_state(self, state):
+        self.state = state
+        if self.listener is not None:
+            self.listener(self)
+
+
+class ProgrammingQueue:
+    # transaction(params, port) makes the coroutine that programs the device,
+    # by default serialCom's programming exchange through the port's session.
+    # on_programmed(job) is called after each job the device received, whether
+    # it confirmed it or can't echo
+    def __init__(self, bridge, scheduler, transaction=asyncSerialCom.program_and_verify, on_programmed=None):
+        self.bridge = bridge
+        self.scheduler = scheduler
+        self.transaction = transaction
+        self.on_programmed = on_programmed
+        self.pending = None
+        self.in_flight = None
+
+    @property
+    def busy(self):
+        return self.pending is not None or self.in_flight is not None
+
+    # Queues params for the device on port, replacing a job that hasn't been sent
+    def submit(self, params, port, serial=None, listener=None):
+        job = ProgrammingJob(params, port, serial, listener)
+        if self.pending is not None:
+            coalesced.add()
+            self.pending.set_state(SUPERSEDED)
+        self.pending = job
+        job.set_state(PENDING)
+
+        # Each submit restarts the wait. While a job is in flight the next
+        # one is started when it finishes instead
+        if self.in_flight is None:
+            self.scheduler.once("programming", COALESCE_DELAY, self.start_next)
+        return job
+
+    def start_next(self):
+        if self.in_flight is not None or self.pending is None:
+            return
+        job, self.pending = self.pending, None
+        self.in_flight = job
+        job.set_state(IN_FLIGHT)
+        self.bridge.submit(self.transaction(job.params, job.port),
+                           lambda result: self.finish(job, result, None),
+                           lambda error: self.finish(job, None, error))
+
+    # Bridge callback on the Tk thread
+    def finish(self, job, result, error):
+        self.in_flight = None
+        job.finished = time.monotonic()
+        job.result = result
+        job.error = error
+        if error is None:
+            programming_latency.record(job.latency)
+            if self.on_programmed is not None:
+                self.on_programmed(job)
+            job.set_state(SENT if result.unverified else CONFIRMED)
+        else:
+            failures.add()
+            job.set_state(FAILED)
+
+        # Submits that arrived in the meantime have already waited long enough
+        if self.pending is not None:
+            self.start_next()
+
+    # Drops the job that hasn't been sent, for when the DCM closes
+    def cancel(self):
+        self.scheduler.cancel("programming")
+        if self.pending is not None:
+            self.pending.set_state(SUPERSEDED)
+            self.pending = None
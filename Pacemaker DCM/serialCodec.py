@@ -0,0 +1,129 @@
+import struct
+import threading
+import timeit
+
+'''
+# Wire formats of every message exchanged with the pacemaker. Each Struct is
+# compiled once at import, packets are packed into reused buffers and replies
+# are unpacked in place from a memoryview
+'''
+
+firstByte = 22
+
+# Order the parameters travel in, matches SET_PARAMS in the Simulink model
+param_fields = ("mode", "atr_pw", "atr_amp", "vent_pw", "vent_amp", "lrl", "url",
+                "arp", "vrp", "atr_sens", "vent_sens", "rate_adapt", "msr",
+                "reaction_time", "recovery_time", "act_thresh", "response_fact")
+param_format = 'BBfBfBBBBBBBBBBfB'
+
+# DCM -> pacemaker: first byte, command byte, then every parameter
+command_packet = struct.Struct('<bb' + param_format)
+
+# Pacemaker -> DCM reply to the echo command. ASSUMED, NOT VERIFIED: the
+# firmware's ECHO_PARAM state doesn't send anything yet (its send call is
+# commented out in the Simulink chart), so there is no reply to check this
+# against. It assumes the parameters in SET_PARAMS order, then the atrial
+# signal as a double, padded to 42 bytes
+echo_reply = struct.Struct('<' + param_format + 'd8x')
+
+# Pacemaker -> DCM reply to one egram request: atrium and ventricle voltages
+egram_sample = struct.Struct('<dd')
+
+# Pacemaker -> DCM header in front of every streamed egram frame
+stream_header = struct.Struct('<2sH')
+
+# Packets are packed into a buffer owned by the calling thread, so the GUI
+# and the egram reader never write into each other's packet
+buffers = threading.local()
+
+def command_buffer():
+    buffer = getattr(buffers, "command", None)
+    if buffer is None:
+        buffer = bytearray(command_packet.size)
+        buffers.command = buffer
+    return buffer
+
+# Packs a command and every parameter, returns the calling thread's buffer.
+# Write it out before encoding the next packet on the same thread
+def encode_command(command, params):
+    buffer = command_buffer()
+    command_packet.pack_into(buffer, 0, firstByte, command, *[params[field] for field in param_fields])
+    return buffer
+
+# Unpacks a command packet back into (command, params)
+def decode_command(data):
+    values = command_packet.unpack_from(memoryview(data))
+    return values[1], dict(zip(param_fields, values[2:]))
+
+# Unpacks the echo reply into a params dict, None if the reply was cut short
+def decode_echo(data):
+    if len(data) < echo_reply.size:
+        return None
+    values = echo_reply.unpack_from(memoryview(data))
+    params = dict(zip(param_fields, values))
+    params["atr_signal"] = values[len(param_fields)]
+    return params
+
+# Packs the echo reply for a params dict, used by device stand-ins
+def encode_echo(params, atr_signal=0.0):
+    return echo_reply.pack(*[params[field] for field in param_fields], atr_signal)
+
+# Each parameter's own wire format, for comparing values the way the device sees them
+field_structs = {field: struct.Struct('<' + code) for field, code in zip(param_fields, param_format)}
+
+# Value after a round trip through the parameter's wire type, floats lose
+# precision and whole numbers stay as they are
+def wire_value(field, value):
+    field_struct = field_structs[field]
+    return field_struct.unpack(field_struct.pack(value))[0]
+
+# Fields the device holds differently from what was sent, as
+# {field: (sent, echoed)}. Every field differs if there was no echo
+def diff_params(sent, echoed):
+    if echoed is None:
+        return {field: (sent[field], None) for field in param_fields}
+    return {field: (sent[field], echoed[field]) for field in param_fields
+            if wire_value(field, sent[field]) != echoed[field]}
+
+# Fields that differ between two parameter sets once on the wire, as
+# {field: (old, new)}
+def changed_params(old, new):
+    return {field: (old[field], new[field]) for field in param_fields
+            if wire_value(field, old[field]) != wire_value(field, new[field])}
+
+# Unpacks one (atrium, ventricle) egram reply, None if the reply was cut short
+def decode_sample(data):
+    if len(data) < egram_sample.size:
+        return None
+    return egram_sample.unpack_from(memoryview(data))
+
+# Zero argument calls exercising each message, shared with dcmBenchmark
+def benchmark_cases():
+    from globalVars import defaultParams
+    from serialCom import echo as echo_command, send
+
+    params = defaultParams()
+    packet = bytes(encode_command(echo_command, params))
+    echo = encode_echo(params)
+    sample = egram_sample.pack(0.5, 0.25)
+
+    return {
+        "encode_command": lambda: encode_command(send, params),
+        "decode_command": lambda: decode_command(packet),
+        "encode_echo": lambda: encode_echo(params),
+        "decode_echo": lambda: decode_echo(echo),
+        "diff_params": lambda: diff_params(params, decode_echo(echo)),
+        "decode_sample": lambda: decode_sample(sample),
+    }
+
+# Times encoding and decoding of each message, returns nanoseconds per call
+def benchmark(number=20000, repeat=5):
+    results = {}
+    for name, case in benchmark_cases().items():
+        times = timeit.repeat(case, number=number, repeat=repeat)
+        results[name] = min(times) / number * 1e9
+    return results
+
+if __name__ == "__main__":
+    for name, ns in benchmark().items():
+        print(f"{name:16} {ns:8.0f} ns")
@@ -1,62 +1,449 @@
 import serial 
 import serial.tools.list_ports
-import struct
+import json
+import numpy as np
+import os
+import threading
+import time
+
+import perfStats
+import serialCodec
+from serialCodec import stream_header
 
-firstByte = 22
 send = 13+6
-echo = 22 + 6
+echo = 0x22  # ECHO_PARAM in the Simulink chart
 get_egram = 47 + 6
+egram_request = 0x47
+
+# Streaming egram commands. While streaming the device pushes frames without
+# being asked. Each frame is a header (sync bytes, uint16 sample count N), N
+# atrium doubles, N ventricle doubles, then a checksum of everything after sync
+start_stream = 0x48
+stop_stream = 0x49
+stream_sync = b'\xaa\x55'
+stream_sample_size = 8
+stream_channels = 2
+stream_max_samples = 4096
+
+# How long to wait for the first frame before assuming older firmware
+stream_probe_time = 0.5
+
+# How long a paused device may keep sending before the pause is given up
+stream_stop_time = 0.5
+
+baudrate = 115200
+timeout = 1
+
+# Transaction statistics shown in the diagnostics window
+open_time = perfStats.histogram("serial.open")
+write_time = perfStats.histogram("serial.write")
+read_latency = perfStats.histogram("serial.read")
+stream_wait = perfStats.histogram("serial.read_available")
+timeouts = perfStats.counter("serial.timeouts")
+bytes_out = perfStats.counter("serial.bytes_out")
+bytes_in = perfStats.counter("serial.bytes_in")
+bad_frames = perfStats.counter("egram.bad_frames")
+
+# Programming transactions: send, echo, compare, resend what didn't take
+verify_retries = 2
+programming_round_trip = perfStats.histogram("programming.round_trip")
+verify_mismatches = perfStats.counter("programming.mismatches")
+
+# Emulated pacemakers register their pseudo-terminals in this folder so port
+# discovery finds them the same way it finds a J-Link port. It is only used
+# when DCM_VIRTUAL_PORTS names it: a registration is trusted as a pacemaker,
+# so a normal run never reads a folder other users could write to
+VIRTUAL_PORT_FOLDER = os.environ.get("DCM_VIRTUAL_PORTS") or None
+
+# Stand-in for the port info objects comports() returns
+class VirtualPortInfo:
+    def __init__(self, device, description, hwid):
+        self.device = device
+        self.description = description
+        self.hwid = hwid
+
+# Every serial port on the system plus any registered emulated pacemakers
+# when virtual ports are turned on
+def list_ports():
+    ports = list(serial.tools.list_ports.comports())
+    if VIRTUAL_PORT_FOLDER and os.path.isdir(VIRTUAL_PORT_FOLDER):
+        for name in sorted(os.listdir(VIRTUAL_PORT_FOLDER)):
+            try:
+                with open(os.path.join(VIRTUAL_PORT_FOLDER, name)) as file:
+                    info = json.load(file)
+            except (OSError, ValueError):
+                continue
+            # Skip registrations left behind by an emulator that didn't exit cleanly
+            if os.path.exists(info["device"]):
+                ports.append(VirtualPortInfo(info["device"], info["description"], info["hwid"]))
+    return ports
+
+# Long lived connection to one pacemaker port. The port is opened once and
+# kept open, access from the GUI and the egram plotters is serialized by lock
+class SerialSession:
+    def __init__(self, port):
+        self.port = port
+        self.ser = None
+        self.lock = threading.RLock()
+
+        # Start and stop packets while the device is streaming egram frames
+        self.stream_start = None
+        self.stream_stop = None
+
+        # Stream bytes that arrived as the stream was paused, for the next read_available()
+        self.held = bytearray()
+
+        # Whether the firmware answers the echo command, None until it is tried
+        self.echoes = None
+
+    # Opens the port if it isn't already open, returns the open connection
+    def connect(self):
+        with self.lock:
+            if self.ser is None or not self.ser.is_open:
+                with open_time.time():
+                    self.ser = serial.Serial(self.port, baudrate=baudrate, timeout=timeout)
+            return self.ser
+
+    # Drops the connection, next call to connect() reopens it
+    def close(self):
+        with self.lock:
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except (serial.SerialException, OSError):
+                    pass
+                self.ser = None
+            self.held.clear()
+            self.echoes = None
+
+    # Writes data then reads back read_size bytes. If the board was unplugged
+    # the stale handle is dropped and the port reopened once
+    def exchange(self, data, read_size=0):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    ser = self.connect()
+                    if data:
+                        with write_time.time():
+                            ser.write(data)
+                        bytes_out.add(len(data))
+                    if read_size:
+                        return self.timed_read(ser, read_size)
+                    return b''
+                except (serial.SerialException, OSError):
+                    self.close()
+                    if attempt:
+                        raise
+
+    # One request/response transaction. A streaming device is paused around
+    # it so the reply isn't mixed in with egram frames
+    def transact(self, data, read_size=0):
+        with self.lock:
+            if not (read_size and self.stream_start):
+                return self.exchange(data, read_size)
+
+            self.exchange(self.stream_stop)
+            self.hold_input()
+            try:
+                return self.exchange(data, read_size)
+            finally:
+                self.exchange(self.stream_start)
+
+    # Discards anything the device has sent that hasn't been read yet
+    def flush_input(self):
+        with self.lock:
+            self.held.clear()
+            if self.ser is not None and self.ser.is_open:
+                self.ser.reset_input_buffer()
+
+    # Sets aside what the device sends until it has been quiet for a moment,
+    # so a frame that was on its way when the stream was paused is neither
+    # lost nor mixed into the reply. A device that is still sending after
+    # limit seconds didn't take the stop packet: its bytes are discarded and
+    # the transaction fails rather than reading frames as the reply
+    def hold_input(self, quiet=0.02, limit=stream_stop_time):
+        with self.lock:
+            ser = self.connect()
+            ser.timeout = quiet
+            deadline = time.monotonic() + limit
+            try:
+                while True:
+                    data = ser.read(max(ser.in_waiting, 1))
+                    if not data:
+                        return
+                    bytes_in.add(len(data))
+                    self.held += data
+                    if time.monotonic() > deadline:
+                        break
+            finally:
+                ser.timeout = timeout
+            self.flush_input()
+            raise serial.SerialException(f"Device on {self.port} kept streaming after it was told to stop")
+
+    # Reads whatever has arrived, blocking for at least min_size bytes or
+    # until wait seconds (the session timeout by default) have passed
+    def read_available(self, min_size=1, wait=None):
+        with self.lock:
+            if self.held:
+                data = bytes(self.held)
+                self.held.clear()
+                return data
+            ser = self.connect()
+            try:
+                if wait is None:
+                    return self.timed_read(ser, max(ser.in_waiting, min_size), stream_wait, expected=False)
+                ser.timeout = wait
+                try:
+                    return self.timed_read(ser, max(ser.in_waiting, min_size), stream_wait, expected=False)
+                finally:
+                    ser.timeout = timeout
+            except (serial.SerialException, OSError):
+                self.close()
+                raise
+
+    # Reads size bytes, recording the latency. A short expected reply is a timeout
+    def timed_read(self, ser, size, latency=read_latency, expected=True):
+        start = time.perf_counter()
+        data = ser.read(size)
+        latency.record(time.perf_counter() - start)
+        bytes_in.add(len(data))
+        if expected and len(data) < size:
+            timeouts.add()
+        return data
+
+    def write(self, data):
+        return self.transact(data)
+
+    def read(self, size):
+        return self.transact(b'', size)
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+# Returns the session for a port, creating it on first use
+def get_session(currPort):
+    with sessions_lock:
+        session = sessions.get(currPort)
+        if session is None:
+            session = SerialSession(currPort)
+            sessions[currPort] = session
+        return session
+
+# Closes every open session, called when the DCM exits
+def close_sessions():
+    with sessions_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
 
 # Send parameters to pacemaker, accepts parameters
 def send_parameters(params,currPort):
-    st = struct.Struct('<bbBBfBfBBBBBBBBBBfB')
-    send_data = st.pack(firstByte,send,params["mode"],params["atr_pw"],params["atr_amp"],
-            params["vent_pw"],params["vent_amp"],params["lrl"],params["url"],
-            params["arp"],params["vrp"],params["atr_sens"],params["vent_sens"],
-            params["rate_adapt"],params["msr"],params["reaction_time"],params["recovery_time"],
-            params["act_thresh"],params["response_fact"])
-
-    with serial.Serial(currPort, baudrate=115200,timeout=1) as ser:
-        ser.write(send_data)
-        ser.close()
-
-# Read sent parameters from pacemaker
+    get_session(currPort).write(serialCodec.encode_command(send, params))
+
+# Read sent parameters from pacemaker, returns them decoded from the echo
+# reply or None if the device didn't answer in full
 def read_params(params,currPort):
-    st = struct.Struct('<bbBBfBfBBBBBBBBBBfB')
-    send_data = st.pack(firstByte,echo,params["mode"],params["atr_pw"],params["atr_amp"],
-            params["vent_pw"],params["vent_amp"],params["lrl"],params["url"],
-            params["arp"],params["vrp"],params["atr_sens"],params["vent_sens"],
-            params["rate_adapt"],params["msr"],params["reaction_time"],params["recovery_time"],
-            params["act_thresh"],params["response_fact"])
-
-    with serial.Serial(currPort, baudrate=115200,timeout=1) as ser:
-        ser.write(send_data)
-        curr_params = ser.read(42) # reading from pacemaker
-        ser.close()
-
-    return curr_params # returns list of current parameters
-
-# begins and ends communication of egram data, accepts bool send_data
-def get_plotData(ser,params):
-    st = struct.Struct('<BBfBfBBBBBBBBBBfB')
-    send_data = b'\x16' + b'\x47' + st.pack(params["mode"],params["atr_pw"],params["atr_amp"],
-            params["vent_pw"],params["vent_amp"],params["lrl"],params["url"],
-            params["arp"],params["vrp"],params["atr_sens"],params["vent_sens"],
-            params["rate_adapt"],params["msr"],params["reaction_time"],params["recovery_time"],
-            params["act_thresh"],params["response_fact"])
-
-    ser.write(send_data)
-    data = ser.read(32)
-    st_read = struct.Struct('<dd')
-    unpacked = st_read.unpack(data)
-
-    try:
-        voltage = unpacked
-    except IndexError:
+    send_data = serialCodec.encode_command(echo, params)
+    curr_params = get_session(currPort).transact(send_data, serialCodec.echo_reply.size) # reading from pacemaker
+
+    return serialCodec.decode_echo(curr_params)
+
+# Outcome of a programming transaction. mismatches holds the fields the
+# device's echo disagreed with on the last attempt. unverified means the
+# parameters were sent to firmware that doesn't answer the echo command, so
+# there was nothing to check them against
+class ProgrammingResult:
+    def __init__(self, params):
+        self.params = dict(params)
+        self.echo = None
+        self.mismatches = {}
+        self.attempts = 0
+        self.latency = None
+        self.unverified = False
+
+    @property
+    def verified(self):
+        return self.echo is not None and not self.mismatches
+
+    def record(self, echo):
+        self.attempts += 1
+        self.echo = echo
+        self.mismatches = serialCodec.diff_params(self.params, echo)
+        if not self.verified:
+            verify_mismatches.add()
+
+    def finish(self, latency):
+        self.latency = latency
+        programming_round_trip.record(latency)
+        if not (self.verified or self.unverified):
+            raise VerifyError(self)
+
+# Raised when the device still disagrees after every retry
+class VerifyError(serial.SerialException):
+    def __init__(self, result):
+        self.result = result
+        if result.echo is None:
+            message = "The pacemaker did not answer the echo request"
+        else:
+            message = "The pacemaker did not take " + ", ".join(result.mismatches)
+        super().__init__(message)
+
+# The send and echo packets of one programming transaction, written together
+def programming_packet(params):
+    return bytes(serialCodec.encode_command(send, params)) + bytes(serialCodec.encode_command(echo, params))
+
+# Sends parameters and reads back the device's echo on the same session,
+# resending while any field differs. Returns a ProgrammingResult whose latency
+# covers every attempt, raises VerifyError if the device never agreed.
+# Firmware that sends no echo at all (ECHO_PARAM's send is commented out in
+# the current Simulink chart) gets an unverified result, and later calls on
+# the session only send until the port is reopened
+def program_and_verify(params, currPort, retries=verify_retries):
+    session = get_session(currPort)
+    result = ProgrammingResult(params)
+    start = time.perf_counter()
+    with session.lock:
+        if session.echoes is False:
+            session.write(serialCodec.encode_command(send, params))
+            result.attempts = 1
+            result.unverified = True
+        else:
+            packet = programming_packet(params)
+            while result.attempts <= retries:
+                reply = session.transact(packet, serialCodec.echo_reply.size)
+                if not reply and session.echoes is None:
+                    session.echoes = False
+                    result.attempts += 1
+                    result.unverified = True
+                    break
+                session.echoes = True
+                result.record(serialCodec.decode_echo(reply))
+                if result.verified:
+                    break
+    result.finish(time.perf_counter() - start)
+    return result
+
+# Requests one egram sample pair over the port's session
+def get_plotData(params,currPort):
+    send_data = serialCodec.encode_command(egram_request, params)
+    data = get_session(currPort).transact(send_data, serialCodec.egram_sample.size)
+
+    voltage = serialCodec.decode_sample(data)
+    if voltage is None:
         print("No data found")
+    return voltage
+
+# Size in bytes of a stream frame carrying count samples per channel
+def stream_frame_size(count):
+    return stream_header.size + count * stream_channels * stream_sample_size + 1
+
+# Finds sample frames in the bytes pushed by a streaming device. Bytes that
+# don't belong to a valid frame are skipped, so a dropped byte costs one frame
+class StreamDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.samples = []
+        self.dropped = 0   # Bytes thrown away while resyncing
+
+        # Bytes still missing from the frame at the front of the buffer
+        self.needed = stream_header.size
+
+    # Adds received bytes, returns how many new samples were decoded
+    def feed(self, data):
+        self.buffer += data
+        found = 0
+
+        while True:
+            start = self.buffer.find(stream_sync)
+            if start < 0:
+                # Keep a trailing byte in case it is the first half of a sync
+                keep = 1 if self.buffer[-1:] == stream_sync[:1] else 0
+                self.dropped += len(self.buffer) - keep
+                del self.buffer[:len(self.buffer) - keep]
+                self.needed = stream_header.size - keep
+                return found
+            if start:
+                self.dropped += start
+                del self.buffer[:start]
+            if len(self.buffer) < stream_header.size:
+                self.needed = stream_header.size - len(self.buffer)
+                return found
+
+            sync, count = stream_header.unpack_from(self.buffer)
+            if count == 0 or count > stream_max_samples:
+                # Not a real header, move past the sync bytes and look again
+                self.dropped += 1
+                del self.buffer[:1]
+                continue
+
+            size = stream_frame_size(count)
+            if len(self.buffer) < size:
+                self.needed = size - len(self.buffer)
+                return found
+
+            frame = bytes(self.buffer[:size])
+            checked = np.frombuffer(frame, dtype=np.uint8, count=size - 3, offset=len(stream_sync))
+            if int(checked.sum()) & 0xFF != frame[-1]:
+                bad_frames.add()
+                self.dropped += 1
+                del self.buffer[:1]
+                continue
+
+            # Channel major doubles, transposed to one (atrium, ventricle) row per sample
+            values = np.frombuffer(frame, dtype='<f8', count=count * stream_channels,
+                                   offset=stream_header.size)
+            self.samples.append(values.reshape(stream_channels, count).T)
+            del self.buffer[:size]
+            found += count
+
+    # Returns and forgets the samples decoded so far as an (n, 2) array
+    def take(self):
+        if not self.samples:
+            return np.empty((0, stream_channels))
+        samples = self.samples[0] if len(self.samples) == 1 else np.concatenate(self.samples)
+        self.samples = []
+        return samples
+
+# Asks the device to start pushing egram frames. Returns a decoder holding the
+# first samples, or None if nothing arrived and the firmware only supports polling
+def start_egram_stream(params, currPort):
+    session = get_session(currPort)
+    decoder = StreamDecoder()
+
+    with session.lock:
+        start_packet = bytes(serialCodec.encode_command(start_stream, params))
+        stop_packet = bytes(serialCodec.encode_command(stop_stream, params))
+        session.exchange(start_packet)
+
+        deadline = time.monotonic() + stream_probe_time
+        while time.monotonic() < deadline:
+            if decoder.feed(session.read_available(1, max(deadline - time.monotonic(), 0))):
+                session.stream_start = start_packet
+                session.stream_stop = stop_packet
+                return decoder
+
+        # Older firmware ignores the command, make sure it isn't half started
+        session.exchange(stop_packet)
+        session.flush_input()
         return None
 
-    return voltage
+# Tells the device to stop pushing egram frames
+def stop_egram_stream(currPort):
+    session = get_session(currPort)
+    with session.lock:
+        if session.stream_stop:
+            stop_packet = session.stream_stop
+            session.stream_start = None
+            session.stream_stop = None
+            session.exchange(stop_packet)
+            session.flush_input()
+
+# Reads the frames pushed since the last call, returns an (n, 2) array of
+# (atrium, ventricle) samples. A whole frame is fetched in one read
+def read_egram_stream(decoder, currPort):
+    decoder.feed(get_session(currPort).read_available(decoder.needed))
+    return decoder.take()
 
 
 
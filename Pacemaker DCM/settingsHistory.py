@@ -0,0 +1,130 @@
+import sqlite3
+
+import numpy as np
+
+import settingsLog
+
+'''
+# Every user's settings history in one SQLite table, one column per parameter,
+# for looking back over months of changes. The per-user logs stay the record
+# of what was saved; this is an index over them, filled by sync(), so it can
+# always be rebuilt from the logs. Queries are by device, mode, user and time
+# range, newest first, a page at a time
+'''
+
+# Seconds a DCM waits for another instance's write before giving up
+BUSY_TIMEOUT = 10.0
+
+# Rows returned by query() unless a limit is given
+PAGE_SIZE = 100
+
+# Parameter columns, every field any mode saves. The mode number is implied
+# by the mode column
+FIELDS = tuple(dict.fromkeys(field for fields in settingsLog.MODE_FIELDS.values()
+                             for field in fields if field != "mode"))
+MODE_NUMBERS = {name: number for (number, _), name in settingsLog.MODE_NAMES.items()}
+
+# Each index ends in the rowid, so (time, id) ordering never needs a sort
+INDEXES = {
+    "settings_time": "time",
+    "settings_mode": "mode, time",
+    "settings_device": "device, time",
+    "settings_device_mode": "device, mode, time",
+    "settings_user": "user, time",
+}
+
+
+class SettingsHistory:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{field} NUMERIC" for field in FIELDS)
+        with self.db:
+            # seq is the entry's number in the user's log
+            self.db.execute(f"""CREATE TABLE IF NOT EXISTS settings (
+                                    id INTEGER PRIMARY KEY,
+                                    user TEXT NOT NULL,
+                                    seq INTEGER NOT NULL,
+                                    time REAL,
+                                    mode TEXT NOT NULL,
+                                    device TEXT,
+                                    {columns},
+                                    UNIQUE (user, seq))""")
+            for name, columns in INDEXES.items():
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON settings ({columns})")
+
+    def close(self):
+        self.db.close()
+
+    # Adds the user's log entries that aren't here yet. Only reads the new
+    # entries, so calling it after every save is cheap. Returns the number added
+    def sync(self, user, log):
+        stored = self.db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM settings WHERE user = ?",
+                                 (user,)).fetchone()[0]
+        entries = log.entries(stored)
+        if not entries:
+            return 0
+
+        columns = ", ".join(FIELDS)
+        marks = ", ".join("?" * (len(FIELDS) + 5))
+        rows = [(user, stored + number, entry["time"], entry["mode"], entry["device"])
+                + tuple(entry["params"].get(field) for field in FIELDS)
+                for number, entry in enumerate(entries)]
+        with self.db:
+            self.db.executemany(f"INSERT OR IGNORE INTO settings (user, seq, time, mode, device, {columns}) "
+                                f"VALUES ({marks})", rows)
+        return len(rows)
+
+    # WHERE clause and arguments shared by the queries
+    @staticmethod
+    def where(device=None, mode=None, user=None, start=None, end=None):
+        clauses, args = [], []
+        for column, value in (("device", device), ("mode", mode), ("user", user)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if start is not None:
+            clauses.append("time >= ?")
+            args.append(start)
+        if end is not None:
+            clauses.append("time < ?")
+            args.append(end)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def count(self, device=None, mode=None, user=None, start=None, end=None):
+        where, args = self.where(device, mode, user, start, end)
+        return self.db.execute(f"SELECT COUNT(*) FROM settings{where}", args).fetchone()[0]
+
+    # Entries matching the filters, newest first, with start <= time < end.
+    # For the next page pass before=(time, id) of the last entry returned.
+    # Entries imported from old CSV histories have no time and are only
+    # counted, they have no place on the timeline
+    def query(self, device=None, mode=None, user=None, start=None, end=None, limit=PAGE_SIZE, before=None):
+        where, args = self.where(device, mode, user, start, end)
+        where += (" AND " if where else " WHERE ") + "time IS NOT NULL"
+        if before is not None:
+            where += " AND (time, id) < (?, ?)"
+            args += list(before)
+
+        cursor = self.db.execute(f"SELECT id, user, time, mode, device, {', '.join(FIELDS)} FROM settings{where} "
+                                 f"ORDER BY time DESC, id DESC LIMIT ?", args + [limit])
+        entries = []
+        for row in cursor:
+            params = {"mode": MODE_NUMBERS[row[3]]}
+            params.update((field, value) for field, value in zip(FIELDS, row[5:]) if value is not None)
+            entries.append({"id": row[0], "user": row[1], "time": row[2], "mode": row[3], "device": row[4],
+                            "params": params})
+        return entries
+
+    # One field's values over time, oldest first, as arrays of times and values.
+    # Entries whose mode doesn't set the field are left out
+    def series(self, field, device=None, mode=None, user=None, start=None, end=None):
+        if field not in FIELDS:
+            raise ValueError(f"Unknown parameter {field!r}")
+        where, args = self.where(device, mode, user, start, end)
+        where += (" AND " if where else " WHERE ") + f"time IS NOT NULL AND {field} IS NOT NULL"
+        rows = self.db.execute(f"SELECT time, {field} FROM settings{where} ORDER BY time, id", args).fetchall()
+
+        data = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        return data[:, 0], data[:, 1]
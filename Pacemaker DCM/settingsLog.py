@@ -0,0 +1,183 @@
+import csv
+import json
+import os
+import struct
+import time
+
+'''
+# Per-user history of submitted pacing settings. Each submission is one JSON
+# line with the mode, time, device serial and named parameter values, and is
+# never rewritten. A sidecar .idx file holds the byte offset of every line,
+# so the latest entry, or any entry by number, is found without a scan
+'''
+
+# Parameters each mode's settings screen sets
+MODE_FIELDS = {
+    "VOO": ("mode", "rate_adapt", "lrl", "url", "vent_amp", "vent_pw"),
+    "AOO": ("mode", "rate_adapt", "lrl", "url", "atr_amp", "atr_pw"),
+    "VVI": ("mode", "rate_adapt", "lrl", "url", "vent_amp", "vent_pw", "vent_sens", "vrp"),
+    "AAI": ("mode", "rate_adapt", "lrl", "url", "atr_amp", "atr_pw", "atr_sens", "arp", "pvarp"),
+    "VOOR": ("mode", "rate_adapt", "lrl", "url", "vent_amp", "vent_pw",
+             "msr", "act_thresh", "reaction_time", "response_fact", "recovery_time"),
+    "AOOR": ("mode", "rate_adapt", "lrl", "url", "atr_amp", "atr_pw",
+             "msr", "act_thresh", "reaction_time", "response_fact", "recovery_time"),
+    "VVIR": ("mode", "rate_adapt", "lrl", "url", "vent_amp", "vent_pw", "vent_sens", "vrp",
+             "msr", "act_thresh", "reaction_time", "response_fact", "recovery_time"),
+    "AAIR": ("mode", "rate_adapt", "lrl", "url", "atr_amp", "atr_pw", "atr_sens", "arp", "pvarp",
+             "msr", "act_thresh", "reaction_time", "response_fact", "recovery_time"),
+}
+
+# Mode name for the (mode, rate_adapt) numbers sent to the pacemaker
+MODE_NAMES = {(1, 0): "AOO", (2, 0): "VOO", (3, 0): "AAI", (4, 0): "VVI",
+              (1, 1): "AOOR", (2, 1): "VOOR", (3, 1): "AAIR", (4, 1): "VVIR"}
+
+offset_format = struct.Struct('<Q')
+
+
+# Value of a number written by the csv module
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+# One submission as stored on disk
+def make_entry(mode, params, device=None, when=None):
+    return {"time": time.time() if when is None else when,
+            "mode": mode,
+            "device": device,
+            "params": {field: params[field] for field in MODE_FIELDS[mode]}}
+
+
+class SettingsLog:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.count = 0
+        self.repair()
+
+    def __len__(self):
+        return self.count
+
+    # Makes the index cover every complete line. Normally only looks at the
+    # last indexed line; after a crash between the two writes it indexes the
+    # lines that were missed, and drops a torn last line
+    def repair(self):
+        if not os.path.exists(self.path):
+            self.count = 0
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+
+        size = os.path.getsize(self.path)
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        self.count = index_size // offset_format.size
+
+        with open(self.path, 'rb') as file:
+            # Start after the last indexed line, or from scratch if the index is off
+            start = 0
+            if self.count:
+                last = self.offset(self.count - 1)
+                line = b''
+                if last < size:
+                    file.seek(last)
+                    line = file.readline()
+                if line.endswith(b'\n'):
+                    start = last + len(line)
+                else:
+                    self.count = 0
+            if start == size and index_size == self.count * offset_format.size:
+                return
+
+            offsets = []
+            file.seek(start)
+            position = start
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                offsets.append(position)
+                position += len(line)
+
+        if position < size:
+            with open(self.path, 'r+b') as file:
+                file.truncate(position)
+        mode = 'r+b' if self.count else 'wb'
+        with open(self.index_path, mode) as index:
+            index.truncate(self.count * offset_format.size)
+            index.seek(self.count * offset_format.size)
+            index.write(b''.join(offset_format.pack(offset) for offset in offsets))
+        self.count += len(offsets)
+
+    def offset(self, number):
+        with open(self.index_path, 'rb') as index:
+            index.seek(number * offset_format.size)
+            return offset_format.unpack(index.read(offset_format.size))[0]
+
+    # Appends entries in one write to each file, making the log's folder if
+    # this is the first entry
+    def extend(self, entries):
+        if not entries:
+            return
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        lines = [(json.dumps(entry, separators=(',', ':')) + '\n').encode() for entry in entries]
+        with open(self.path, 'ab') as file:
+            position = file.tell()
+            file.write(b''.join(lines))
+        offsets = []
+        for line in lines:
+            offsets.append(offset_format.pack(position))
+            position += len(line)
+        with open(self.index_path, 'ab') as index:
+            index.write(b''.join(offsets))
+        self.count += len(lines)
+
+    # Records one submission, returns the stored entry
+    def append(self, mode, params, device=None, when=None):
+        entry = make_entry(mode, params, device, when)
+        self.extend([entry])
+        return entry
+
+    # Entry by number, negative numbers count from the end
+    def entry(self, number):
+        if number < 0:
+            number += self.count
+        if not 0 <= number < self.count:
+            raise IndexError(number)
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset(number))
+            return json.loads(file.readline())
+
+    # Most recent submission, None if there are none
+    def latest(self):
+        return self.entry(-1) if self.count else None
+
+    # Entries start..stop-1, for paging through the history
+    def entries(self, start=0, stop=None):
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return []
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset(start))
+            return [json.loads(file.readline()) for _ in range(stop - start)]
+
+    # Imports a history written by the old save_settings, whose rows were
+    # [0, mode, rate_adapt, ...] with one width per mode. The entries have no
+    # time or device. Returns the number imported
+    def import_csv(self, csv_path):
+        entries = []
+        with open(csv_path, mode='r', newline='') as file:
+            for row in csv.reader(file):
+                try:
+                    mode = MODE_NAMES[(int(row[1]), int(row[2]))]
+                except (IndexError, ValueError, KeyError):
+                    continue  # Header or a row that isn't settings
+                fields = MODE_FIELDS[mode]
+                if len(row) != len(fields) + 1:
+                    continue
+                params = {field: number(value) for field, value in zip(fields, row[1:])}
+                entries.append({"time": None, "mode": mode, "device": None, "params": params})
+        self.extend(entries)
+        return len(entries)
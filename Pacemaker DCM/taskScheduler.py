@@ -0,0 +1,129 @@
+import time
+import traceback
+
+from matplotlib.backend_bases import TimerBase
+
+import perfStats
+
+'''
+# One owner for every recurring job on the Tk main loop. Jobs are keyed by
+# name, so scheduling a name that is already scheduled replaces it instead of
+# starting a second chain of after() callbacks. Each job's run time goes to
+# a perfStats histogram, and how late it ran to tk.after_lag
+'''
+
+after_lag = perfStats.histogram("tk.after_lag")
+
+
+# A named job, periodic if interval is set, otherwise run once after delay
+class Task:
+    def __init__(self, name, fn, delay, interval=None):
+        self.name = name
+        self.fn = fn
+        self.delay = delay
+        self.interval = interval
+        self.after_id = None
+        self.due = None
+        self.runs = 0
+        self.errors = 0
+        self.duration = perfStats.histogram(f"task.{name}")
+
+    @property
+    def periodic(self):
+        return self.interval is not None
+
+
+class Scheduler:
+    def __init__(self, root):
+        self.root = root
+        self.tasks = {}
+
+    # Run fn every interval ms, the first time after delay ms (interval by default)
+    def every(self, name, interval, fn, delay=None):
+        return self.add(Task(name, fn, interval if delay is None else delay, interval))
+
+    # Run fn once after delay ms. Scheduling the same name again restarts the wait
+    def once(self, name, delay, fn):
+        return self.add(Task(name, fn, delay))
+
+    def add(self, task):
+        self.cancel(task.name)
+        self.tasks[task.name] = task
+        self.arm(task, task.delay)
+        return task
+
+    def arm(self, task, delay):
+        task.due = time.monotonic() + delay / 1000.0
+        task.after_id = self.root.after(delay, self.run, task)
+
+    def cancel(self, name):
+        task = self.tasks.pop(name, None)
+        if task is not None and task.after_id is not None:
+            self.root.after_cancel(task.after_id)
+            task.after_id = None
+
+    def cancel_all(self):
+        for name in list(self.tasks):
+            self.cancel(name)
+
+    def is_active(self, name):
+        return name in self.tasks
+
+    def run(self, task):
+        start = time.monotonic()
+        after_lag.record(max(start - task.due, 0.0))
+        task.after_id = None
+        if not task.periodic:
+            self.tasks.pop(task.name, None)
+
+        try:
+            task.fn()
+        except Exception:
+            # One failing run shouldn't end a periodic job
+            task.errors += 1
+            traceback.print_exc()
+        finally:
+            task.runs += 1
+            task.duration.record(time.monotonic() - start)
+
+        # Still ours unless fn cancelled or replaced it
+        if task.periodic and self.tasks.get(task.name) is task:
+            self.arm(task, task.interval)
+
+    # One line per scheduled job for the diagnostics window
+    def describe(self):
+        lines = [f"{len(self.tasks)} scheduled tasks"]
+        for task in self.tasks.values():
+            every = f"every {task.interval} ms" if task.periodic else f"once in {task.delay} ms"
+            stats = task.duration.snapshot()
+            lines.append(f"  {task.name:24}{every:>18}{task.runs:8} runs  mean "
+                         f"{perfStats.format_time(stats['mean'])}  max {perfStats.format_time(stats['max'])}"
+                         + (f"  {task.errors} errors" if task.errors else ""))
+        return lines
+
+    # Matplotlib timer whose ticks are a scheduler job, for animations
+    def timer(self, name, interval):
+        return SchedulerTimer(self, name, interval)
+
+
+# Matplotlib timer run by the scheduler instead of its own Tk timer, so the
+# egram frames are one more named job
+class SchedulerTimer(TimerBase):
+    def __init__(self, scheduler, name, interval):
+        self.scheduler = scheduler
+        self.name = name
+        super().__init__(interval=interval)
+
+    def _timer_start(self):
+        self._timer_stop()
+        if self._single:
+            self.scheduler.once(self.name, self._interval, self._on_timer)
+        else:
+            self.scheduler.every(self.name, self._interval, self._on_timer)
+
+    def _timer_stop(self):
+        self.scheduler.cancel(self.name)
+
+    def _timer_set_interval(self):
+        if self.scheduler.is_active(self.name):
+            self._timer_start()
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import asyncSerialCom
+import serialCom
+from deviceEmulator import DeviceEmulator
+from globalVars import defaultParams
+
+
+@pytest.fixture
+def bridge():
+    bridge = asyncSerialCom.AsyncBridge()
+    bridge.start()
+    yield bridge
+    bridge.stop()
+    serialCom.close_sessions()
+
+
+# Polls the bridge like the Tk scheduler would until a callback has run
+def wait_for(bridge, outcomes, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not outcomes and time.monotonic() < deadline:
+        bridge.poll()
+        time.sleep(0.01)
+    return outcomes
+
+
+def test_program_and_verify_off_the_calling_thread(bridge):
+    emulator = DeviceEmulator(serial_number="000000999991", streaming=False, echo=True)
+    port = emulator.start()
+    try:
+        outcomes = []
+        params = dict(defaultParams(), lrl=72)
+        bridge.submit(asyncSerialCom.program_and_verify(params, port), outcomes.append, outcomes.append)
+
+        # Results only come back through poll(), on the thread that calls it
+        assert outcomes == []
+        result, = wait_for(bridge, outcomes)
+        assert isinstance(result, serialCom.ProgrammingResult)
+        assert result.verified
+        assert emulator.params["lrl"] == 72
+    finally:
+        emulator.stop()
+
+
+def test_errors_go_to_on_error(bridge, tmp_path):
+    done, errors = [], []
+    missing = str(tmp_path / "no-such-port")
+    bridge.submit(asyncSerialCom.program_and_verify(defaultParams(), missing), done.append, errors.append)
+
+    error, = wait_for(bridge, errors)
+    assert isinstance(error, serialCom.serial.SerialException)
+    assert done == []
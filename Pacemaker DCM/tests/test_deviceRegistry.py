@@ -0,0 +1,76 @@
+import csv
+
+import pytest
+
+import deviceRegistry
+
+
+def rows(path):
+    with open(path, newline='') as file:
+        return [row for row in csv.reader(file) if row]
+
+
+def test_events_survive_reload(tmp_path):
+    path = str(tmp_path / "devices.csv")
+    registry = deviceRegistry.DeviceRegistry(path)
+    registry.observe("000000900001")
+    registry.programmed("000000900001", {"lrl": 70})
+    registry.observe(None)
+    registry.add("000000900002")
+    registry.flush()
+
+    reloaded = deviceRegistry.DeviceRegistry(path)
+    record = reloaded.get("000000900001")
+    assert record.connections == 1
+    assert record.last_params == {"lrl": 70}
+    assert record.last_seen >= record.first_seen
+    assert "000000900002" in reloaded
+    assert reloaded.get("000000900002").connections == 0
+
+
+def test_reads_old_one_serial_per_row_file(tmp_path):
+    path = tmp_path / "devices.csv"
+    path.write_text("000000900001\n000000900002\n")
+
+    registry = deviceRegistry.DeviceRegistry(str(path))
+    assert len(registry) == 2
+    assert registry.get("000000900001").last_params is None
+
+
+def test_long_log_is_compacted_on_load(tmp_path):
+    path = str(tmp_path / "devices.csv")
+    registry = deviceRegistry.DeviceRegistry(path)
+    for lrl in range(60, 60 + 2 * deviceRegistry.COMPACT_RATIO):
+        registry.observe("000000900001")
+        registry.programmed("000000900001", {"lrl": lrl})
+        registry.observe(None)
+    registry.flush()
+    before = registry.get("000000900001").to_dict()
+    assert len(rows(path)) > deviceRegistry.COMPACT_RATIO
+
+    reloaded = deviceRegistry.DeviceRegistry(path)
+    assert rows(path)[0][:2] == ["000000900001", deviceRegistry.SNAPSHOT]
+    assert len(rows(path)) == 1
+    after = reloaded.get("000000900001").to_dict()
+    assert after["connections"] == before["connections"]
+    assert after["last_params"] == before["last_params"]
+    # Times are stored to the millisecond
+    for key in ("first_seen", "last_seen", "last_programmed"):
+        assert after[key] == pytest.approx(before[key], abs=1e-3)
+
+    # Later events append after the snapshot and replay on top of it
+    reloaded.programmed("000000900001", {"lrl": 99})
+    reloaded.flush()
+    again = deviceRegistry.DeviceRegistry(path)
+    assert again.get("000000900001").last_params == {"lrl": 99}
+    assert again.get("000000900001").connections == before["connections"]
+
+
+def test_short_log_is_left_alone(tmp_path):
+    path = str(tmp_path / "devices.csv")
+    registry = deviceRegistry.DeviceRegistry(path)
+    registry.observe("000000900001")
+    registry.flush()
+
+    deviceRegistry.DeviceRegistry(path)
+    assert rows(path)[0][1] == deviceRegistry.SEEN
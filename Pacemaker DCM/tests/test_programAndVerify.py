@@ -0,0 +1,38 @@
+import pytest
+
+import serialCom
+from deviceEmulator import DeviceEmulator
+from globalVars import defaultParams
+
+
+@pytest.fixture
+def emulator(request):
+    emulator = DeviceEmulator(serial_number="000000999990", streaming=False, **request.param)
+    port = emulator.start()
+    yield emulator, port
+    serialCom.close_sessions()
+    emulator.stop()
+
+
+@pytest.mark.parametrize("emulator", [{"echo": True}], indirect=True)
+def test_echoing_device_is_verified(emulator):
+    device, port = emulator
+    params = dict(defaultParams(), lrl=75, vent_amp=3.5)
+    result = serialCom.program_and_verify(params, port)
+
+    assert result.verified
+    assert not result.unverified
+    assert device.params["lrl"] == 75
+
+
+@pytest.mark.parametrize("emulator", [{}], indirect=True)
+def test_silent_device_is_sent_unverified(emulator):
+    device, port = emulator
+    params = dict(defaultParams(), lrl=80)
+    result = serialCom.program_and_verify(params, port)
+
+    assert result.unverified
+    assert device.params["lrl"] == 80
+    # The session remembers the device doesn't echo and stops asking
+    assert serialCom.get_session(port).echoes is False
+    assert serialCom.program_and_verify(params, port).unverified
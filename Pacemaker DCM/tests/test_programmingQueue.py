@@ -0,0 +1,135 @@
+import pytest
+
+import programmingQueue
+import serialCom
+import taskScheduler
+from globalVars import defaultParams
+
+
+# Stands in for Tk: after() callbacks only run when the test calls run()
+class FakeRoot:
+    def __init__(self):
+        self.callbacks = {}
+        self.next_id = 0
+
+    def after(self, delay, fn, *args):
+        self.next_id += 1
+        self.callbacks[self.next_id] = (fn, args)
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.callbacks.pop(after_id, None)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, {}
+        for fn, args in callbacks.values():
+            fn(*args)
+
+
+# Stands in for the AsyncBridge: keeps each transaction until the test finishes it
+class FakeBridge:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, coro, on_done=None, on_error=None):
+        coro.close()
+        self.submitted.append((on_done, on_error))
+
+
+async def transaction(params, port):
+    pass
+
+
+def result(params, unverified=False):
+    result = serialCom.ProgrammingResult(params)
+    result.unverified = unverified
+    return result
+
+
+@pytest.fixture
+def setup():
+    root = FakeRoot()
+    bridge = FakeBridge()
+    programmed = []
+    queue = programmingQueue.ProgrammingQueue(bridge, taskScheduler.Scheduler(root), transaction,
+                                              on_programmed=programmed.append)
+    return queue, root, bridge, programmed
+
+
+def submit(queue, lrl, states):
+    return queue.submit(dict(defaultParams(), lrl=lrl), "port", "000000900001",
+                        lambda job: states.append((lrl, job.state)))
+
+
+def test_burst_is_coalesced_into_one_transaction(setup):
+    queue, root, bridge, programmed = setup
+    states = []
+    first = submit(queue, 61, states)
+    second = submit(queue, 62, states)
+    last = submit(queue, 63, states)
+
+    assert first.state == second.state == programmingQueue.SUPERSEDED
+    assert last.state == programmingQueue.PENDING
+    assert bridge.submitted == []
+
+    root.run()
+    assert len(bridge.submitted) == 1
+    assert last.state == programmingQueue.IN_FLIGHT
+
+    on_done, _ = bridge.submitted[0]
+    on_done(result(last.params))
+    assert last.state == programmingQueue.CONFIRMED
+    assert programmed == [last]
+    assert not queue.busy
+    assert states[-1] == (63, programmingQueue.CONFIRMED)
+
+
+def test_submit_while_in_flight_waits_for_it(setup):
+    queue, root, bridge, programmed = setup
+    states = []
+    first = submit(queue, 61, states)
+    root.run()
+    second = submit(queue, 62, states)
+    third = submit(queue, 63, states)
+
+    # Only the in-flight job is with the bridge, the newest submit waits behind it
+    assert len(bridge.submitted) == 1
+    assert second.state == programmingQueue.SUPERSEDED
+    assert third.state == programmingQueue.PENDING
+
+    bridge.submitted[0][0](result(first.params))
+    assert first.state == programmingQueue.CONFIRMED
+    assert third.state == programmingQueue.IN_FLIGHT
+    assert len(bridge.submitted) == 2
+
+
+def test_unverified_send_is_recorded(setup):
+    queue, root, bridge, programmed = setup
+    job = submit(queue, 70, [])
+    root.run()
+    bridge.submitted[0][0](result(job.params, unverified=True))
+
+    assert job.state == programmingQueue.SENT
+    assert programmed == [job]
+
+
+def test_failure_is_not_recorded(setup):
+    queue, root, bridge, programmed = setup
+    job = submit(queue, 70, [])
+    root.run()
+    bridge.submitted[0][1](serialCom.serial.SerialException("gone"))
+
+    assert job.state == programmingQueue.FAILED
+    assert programmed == []
+    assert not queue.busy
+
+
+def test_cancel_drops_pending_job(setup):
+    queue, root, bridge, programmed = setup
+    job = submit(queue, 70, [])
+    queue.cancel()
+    root.run()
+
+    assert job.state == programmingQueue.SUPERSEDED
+    assert bridge.submitted == []
+    assert not queue.busy
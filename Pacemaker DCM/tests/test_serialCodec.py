@@ -0,0 +1,65 @@
+import struct
+
+import pytest
+
+import serialCodec
+from serialCom import send
+from globalVars import defaultParams
+
+
+def test_command_round_trip():
+    params = defaultParams()
+    params.update(mode=3, atr_amp=3.5, lrl=75, act_thresh=0.25)
+    packet = bytes(serialCodec.encode_command(send, params))
+
+    assert len(packet) == serialCodec.command_packet.size
+    assert packet[0] == serialCodec.firstByte
+    command, decoded = serialCodec.decode_command(packet)
+    assert command == send
+    assert decoded == {field: params[field] for field in serialCodec.param_fields}
+
+
+def test_command_float_fields_lose_precision():
+    params = defaultParams()
+    params["vent_amp"] = 2.1
+    _, decoded = serialCodec.decode_command(serialCodec.encode_command(send, params))
+
+    assert decoded["vent_amp"] == pytest.approx(2.1)
+    assert decoded["vent_amp"] == serialCodec.wire_value("vent_amp", 2.1)
+
+
+def test_encode_command_out_of_range_raises():
+    params = defaultParams()
+    params["lrl"] = 300
+    with pytest.raises(struct.error):
+        serialCodec.encode_command(send, params)
+
+
+def test_echo_round_trip():
+    params = defaultParams()
+    echo = serialCodec.decode_echo(serialCodec.encode_echo(params, atr_signal=0.75))
+
+    assert echo["atr_signal"] == 0.75
+    assert serialCodec.diff_params(params, echo) == {}
+
+
+def test_short_replies_decode_to_none():
+    echo = serialCodec.encode_echo(defaultParams())
+    assert serialCodec.decode_echo(echo[:-1]) is None
+    assert serialCodec.decode_sample(b'\x00' * (serialCodec.egram_sample.size - 1)) is None
+
+
+def test_diff_params_reports_mismatches():
+    params = defaultParams()
+    echo = serialCodec.decode_echo(serialCodec.encode_echo(dict(params, lrl=61)))
+
+    assert serialCodec.diff_params(params, echo) == {"lrl": (60, 61)}
+    missing = serialCodec.diff_params(params, None)
+    assert set(missing) == set(serialCodec.param_fields)
+
+
+def test_changed_params_ignores_float_noise():
+    old = defaultParams()
+    new = dict(old, vent_amp=old["vent_amp"] + 1e-9, url=120)
+
+    assert serialCodec.changed_params(old, new) == {"url": (60, 120)}
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+import serialCom
+from deviceEmulator import DeviceEmulator
+from globalVars import defaultParams
+
+
+# Samples decoded from the stream over the given seconds
+def read_for(decoder, port, seconds):
+    samples = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        samples.extend(serialCom.read_egram_stream(decoder, port))
+    return samples
+
+
+@pytest.fixture
+def streaming():
+    # A frame every 4 ms, more often than the quiet gap the pause waits for
+    emulator = DeviceEmulator(serial_number="000000999992", frame_samples=4)
+    port = emulator.start()
+    decoder = serialCom.start_egram_stream(defaultParams(), port)
+    assert decoder is not None
+    yield emulator, port
+    serialCom.close_sessions()
+    emulator.stop()
+
+
+def test_transaction_pauses_the_stream(streaming):
+    emulator, port = streaming
+    decoder = serialCom.StreamDecoder()
+
+    assert serialCom.get_plotData(defaultParams(), port) is not None
+    # Frames held while the stream was paused are handed to the next reads,
+    # then the restarted stream carries on
+    assert len(read_for(decoder, port, 0.2)) >= 0.1 * emulator.sample_rate
+    assert emulator.streaming
+
+
+def test_device_that_keeps_streaming_fails_the_transaction(streaming):
+    emulator, port = streaming
+    handle = emulator.handle
+    emulator.handle = lambda packet: None if packet[1] == serialCom.stop_stream else handle(packet)
+
+    start = time.monotonic()
+    with pytest.raises(serialCom.serial.SerialException):
+        serialCom.get_plotData(defaultParams(), port)
+    assert time.monotonic() - start < serialCom.stream_stop_time + 1
+    # The session isn't left locked
+    assert serialCom.get_session(port).lock.acquire(timeout=1)
+    serialCom.get_session(port).lock.release()
@@ -0,0 +1,98 @@
+import os
+
+import settingsLog
+from globalVars import defaultParams
+
+
+def fill(path, count):
+    log = settingsLog.SettingsLog(path)
+    for lrl in range(60, 60 + count):
+        log.append("VOO", dict(defaultParams(), lrl=lrl), device="000000900001", when=float(lrl))
+    return log
+
+
+def test_entries_by_number(tmp_path):
+    log = fill(str(tmp_path / "user.jsonl"), 5)
+
+    assert len(log) == 5
+    assert log.entry(0)["params"]["lrl"] == 60
+    assert log.latest()["params"]["lrl"] == 64
+    assert [entry["time"] for entry in log.entries(1, 3)] == [61.0, 62.0]
+    assert len(settingsLog.SettingsLog(log.path)) == 5
+
+
+def test_rebuilds_missing_index(tmp_path):
+    log = fill(str(tmp_path / "user.jsonl"), 4)
+    os.remove(log.index_path)
+
+    reopened = settingsLog.SettingsLog(log.path)
+    assert len(reopened) == 4
+    assert reopened.entry(2)["params"]["lrl"] == 62
+
+
+def test_indexes_lines_written_after_the_index(tmp_path):
+    log = fill(str(tmp_path / "user.jsonl"), 4)
+    # Crash between the two writes: the last line made it, its offset didn't
+    with open(log.index_path, 'r+b') as index:
+        index.truncate(3 * settingsLog.offset_format.size)
+
+    reopened = settingsLog.SettingsLog(log.path)
+    assert len(reopened) == 4
+    assert reopened.latest()["params"]["lrl"] == 63
+
+
+def test_drops_torn_last_line(tmp_path):
+    log = fill(str(tmp_path / "user.jsonl"), 3)
+    with open(log.path, 'ab') as file:
+        file.write(b'{"time": 99, "mo')
+
+    reopened = settingsLog.SettingsLog(log.path)
+    assert len(reopened) == 3
+    reopened.append("VOO", defaultParams(), when=100.0)
+    assert reopened.latest()["time"] == 100.0
+    assert reopened.entry(2)["params"]["lrl"] == 62
+
+
+def test_index_past_end_of_log_is_rebuilt(tmp_path):
+    log = fill(str(tmp_path / "user.jsonl"), 3)
+    with open(log.index_path, 'ab') as index:
+        index.write(settingsLog.offset_format.pack(10 ** 9))
+
+    reopened = settingsLog.SettingsLog(log.path)
+    assert len(reopened) == 3
+    assert os.path.getsize(reopened.index_path) == 3 * settingsLog.offset_format.size
+
+
+def test_import_csv(tmp_path):
+    path = tmp_path / "old.csv"
+    path.write_text("Time,Mode\n"
+                    "0,2,0,60,120,3.5,10\n"
+                    "0,3,1,60,120,3.5,10,4,250,1,120,0.5,30,10,30\n"
+                    "0,2,0,60\n")
+
+    log = settingsLog.SettingsLog(str(tmp_path / "user.jsonl"))
+    assert log.import_csv(str(path)) == 2
+    assert log.entry(0)["mode"] == "VOO"
+    assert log.entry(0)["params"]["vent_amp"] == 3.5
+    assert log.entry(1)["mode"] == "AAIR"
+    assert log.entry(1)["time"] is None
+
+
+def test_save_after_display_on_fresh_install(tmp_path):
+    import dcmBenchmark
+    import settingsHistory
+
+    dcm = dcmBenchmark.load_dcm_functions(str(tmp_path))
+    dcm["curr_user"] = "alice"
+    dcm["settings_history"] = settingsHistory.SettingsHistory(str(tmp_path / "settings_history.db"))
+    try:
+        # Opening the history to display it caches the log before its folder exists
+        dcm["display_current_settings"]()
+        dcm["save_settings"]("VOO", defaultParams())
+
+        log = dcm["get_user_settings_log"]("alice")
+        assert len(log) == 1
+        assert os.path.exists(tmp_path / "user_csvs" / "alice.jsonl")
+        assert dcm["settings_history"].count(user="alice") == 1
+    finally:
+        dcm["settings_history"].close()
@@ -0,0 +1,64 @@
+import struct
+
+import numpy as np
+
+import serialCom
+
+
+# One stream frame the way the emulator writes it
+def frame(atr, vent, checksum=None):
+    body = struct.pack('<H', len(atr)) + np.concatenate([atr, vent]).astype('<f8').tobytes()
+    if checksum is None:
+        checksum = int(np.frombuffer(body, dtype=np.uint8).sum()) & 0xFF
+    return serialCom.stream_sync + body + bytes([checksum])
+
+
+def test_decodes_frames_split_across_reads():
+    decoder = serialCom.StreamDecoder()
+    data = frame([0.1, 0.2, 0.3], [1.1, 1.2, 1.3]) + frame([0.4], [1.4])
+
+    found = sum(decoder.feed(data[i:i + 5]) for i in range(0, len(data), 5))
+
+    assert found == 4
+    assert decoder.dropped == 0
+    np.testing.assert_array_equal(decoder.take(), [[0.1, 1.1], [0.2, 1.2], [0.3, 1.3], [0.4, 1.4]])
+    assert decoder.take().shape == (0, 2)
+
+
+def test_resyncs_after_garbage():
+    decoder = serialCom.StreamDecoder()
+    # Junk, including a lone first sync byte, before a real frame
+    found = decoder.feed(b'\x01\x02\xaa\x03' + frame([0.5], [0.6]))
+
+    assert found == 1
+    assert decoder.dropped == 4
+    np.testing.assert_array_equal(decoder.take(), [[0.5, 0.6]])
+
+
+def test_keeps_half_sync_at_end_of_read():
+    decoder = serialCom.StreamDecoder()
+    data = frame([0.5], [0.6])
+
+    assert decoder.feed(b'\x07' + data[:1]) == 0
+    assert decoder.feed(data[1:]) == 1
+    assert decoder.dropped == 1
+
+
+def test_bad_checksum_drops_frame():
+    decoder = serialCom.StreamDecoder()
+    good = frame([0.7], [0.8])
+    bad = frame([0.1, 0.2], [0.3, 0.4], checksum=(good[-1] + 1) & 0xFF)
+    bad_frames = serialCom.bad_frames.value
+
+    assert decoder.feed(bad + good) == 1
+    assert serialCom.bad_frames.value == bad_frames + 1
+    assert decoder.dropped == len(bad)
+    np.testing.assert_array_equal(decoder.take(), [[0.7, 0.8]])
+
+
+def test_skips_header_with_impossible_count():
+    decoder = serialCom.StreamDecoder()
+    fake = serialCom.stream_sync + struct.pack('<H', serialCom.stream_max_samples + 1)
+
+    assert decoder.feed(fake + frame([0.9], [1.0])) == 1
+    np.testing.assert_array_equal(decoder.take(), [[0.9, 1.0]])
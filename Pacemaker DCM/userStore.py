@@ -0,0 +1,73 @@
+import csv
+import os
+import sqlite3
+import time
+
+'''
+# Clinician accounts in a single SQLite file. Names are the primary key, so
+# lookups and inserts use the table's index whatever the number of users, and
+# each registration is its own transaction. WAL mode and a busy timeout let
+# several DCM instances share the file
+'''
+
+# Seconds a DCM waits for another instance's write before giving up
+BUSY_TIMEOUT = 10.0
+
+
+class UserStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS users (
+                                   name TEXT PRIMARY KEY,
+                                   password TEXT NOT NULL,
+                                   created REAL)""")
+
+    def close(self):
+        self.db.close()
+
+    # Adds a user, returns False if the name is already taken
+    def add(self, name, password):
+        try:
+            with self.db:
+                self.db.execute("INSERT INTO users (name, password, created) VALUES (?, ?, ?)",
+                                (name, password, time.time()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def exists(self, name):
+        return self.db.execute("SELECT 1 FROM users WHERE name = ?", (name,)).fetchone() is not None
+
+    # True if the user exists and the password matches
+    def check(self, name, password):
+        row = self.db.execute("SELECT password FROM users WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == password
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def names(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM users ORDER BY name")]
+
+    # Imports a users.csv of [name, password] rows in one transaction, then
+    # renames it so it is only imported once. Returns the number of users added
+    def migrate_csv(self, csv_path):
+        if not os.path.exists(csv_path):
+            return 0
+        with open(csv_path, mode='r', newline='') as file:
+            rows = [(row[0], row[1], None) for row in csv.reader(file) if len(row) == 2]
+
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO users (name, password, created) VALUES (?, ?, ?)", rows)
+            added = self.db.total_changes - before
+
+        # Another DCM may have migrated it first
+        try:
+            os.replace(csv_path, csv_path + '.migrated')
+        except FileNotFoundError:
+            pass
+        return added